@@ -0,0 +1,327 @@
+#Benchmarks the hot path of every script in Scripts/ on synthetic inputs, at several sizes, with correctness checks.
+#Each case calls the script's importable entry point in-process. All inputs are generated in a temporary directory, so this runs offline.
+#Timings (best of --repeat runs) are compared against the baselines stored in baselines.json next to this file. Baselines are
+#machine specific: store them with --save-baseline on the reference machine, and commit baselines.json to share them.
+#Usage:
+#   python Hot_Path_Benchmark.py [--sizes small medium] [--cases ci lfp_continuous] [--repeat 3]
+#   python Hot_Path_Benchmark.py --save-baseline    #store the current timings as the new baselines
+#Exits with a non zero code if a case fails (failed correctness check or error), or is slower than its baseline by more than
+#--tolerance. Cases without a baseline are listed at the end but only fail with --require-baseline.
+#The same cases can be run through pytest-benchmark instead, see test_Hot_Path_Benchmark.py.
+
+import argparse, contextlib, csv, io, json, math, os, shutil, sys, tempfile, time
+import numpy
+from osgeo import gdal, ogr, osr
+from datetime import datetime, timedelta
+
+gdal.UseExceptions()
+
+scriptsDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Scripts")
+baselinesPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+sys.path.insert(0, scriptsDir)
+import Convergence_Index, Continuous_Longest_Flow_Path, Discrete_Longest_Flow_Path, Batch_Raster_Sampler, Batch_Raster_Sampler_Multiband
+
+#Size of the synthetic inputs for each case, per preset.
+sizes = {"small" :  {"ci" : 64,  "lfp" : 64,  "dailyDays" : 365,  "dailySize" : 64,  "multibandYears" : 2,  "multibandSize" : 32},
+         "medium" : {"ci" : 256, "lfp" : 256, "dailyDays" : 1461, "dailySize" : 128, "multibandYears" : 10, "multibandSize" : 64},
+         "large" :  {"ci" : 1024, "lfp" : 512, "dailyDays" : 3652, "dailySize" : 256, "multibandYears" : 40, "multibandSize" : 64}}
+
+noDataValue = -9999.0
+fdrNoDataValue = -32768
+
+#Flow directions for East and South in each FDR convention, used to build the synthetic FDRs.
+fdrDirections = {"TauDEM" : {"E" : 1, "S" : 7},
+                 "GRASS" : {"E" : 8, "S" : 6}}
+
+#Call function, silencing its progress prints
+def Quiet(function, *args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(*args, **kwargs)
+
+def CreateRaster(rasterPath : str, array, eType, noData, pixelSize : float = 1.0):
+    bands = 1 if array.ndim == 2 else array.shape[0]
+    sizeY, sizeX = array.shape[-2:]
+    crs = osr.SpatialReference()
+    crs.ImportFromEPSG(32636)
+
+    raster = gdal.GetDriverByName("GTiff").Create(rasterPath, xsize = sizeX, ysize = sizeY, bands = bands, eType = eType)
+    raster.SetProjection(crs.ExportToWkt())
+    raster.SetGeoTransform([0.0, pixelSize, 0.0, sizeY * pixelSize, 0.0, -pixelSize])
+    for band in range(1, bands + 1):
+        raster.GetRasterBand(band).SetNoDataValue(noData)
+        raster.GetRasterBand(band).WriteArray(array if array.ndim == 2 else array[band - 1])
+    raster = None
+
+#geometries is a list of ogr geometries, written as a single layer GeoPackage in the synthetic rasters' CRS.
+def CreateVectors(vectorPath : str, geometries : list, geometryType):
+    crs = osr.SpatialReference()
+    crs.ImportFromEPSG(32636)
+    vectors = ogr.GetDriverByName("GPKG").CreateDataSource(vectorPath)
+    layer = vectors.CreateLayer("features", crs, geometryType)
+    for geometry in geometries:
+        feature = ogr.Feature(layer.GetLayerDefn())
+        feature.SetGeometry(geometry)
+        layer.CreateFeature(feature)
+    vectors = None
+
+def ReadRaster(rasterPath : str):
+    return gdal.Open(rasterPath, gdal.GA_ReadOnly).ReadAsArray()
+
+#Convergence index
+#Reference CI computed with whole array shifts, independently of the script's per-cell loop. Like the script, the central cell's
+#term is added to the sum but not counted.
+def ReferenceCI(aspect, window : int):
+    sizeY, sizeX = aspect.shape
+    ci = numpy.zeros((sizeY - 2 * window, sizeX - 2 * window), dtype = numpy.float64)
+    for row in range(0, 2 * window + 1):
+        for column in range(0, 2 * window + 1):
+            centerDir = math.degrees(math.atan2(window - column, row - window)) % 360.0
+            shifted = aspect[row : row + sizeY - 2 * window, column : column + sizeX - 2 * window]
+            ci += 180.0 - numpy.abs(numpy.abs(shifted - numpy.float32(centerDir)) - 180.0)
+    return ci / ((2 * window + 1) ** 2 - 1) - 90.0
+
+def PrepareCI(workDir : str, size : int) -> dict:
+    aspect = numpy.random.default_rng(size).uniform(0.0, 360.0, size = (size, size)).astype(numpy.float32)
+    inputPath = os.path.join(workDir, "aspect.tif")
+    CreateRaster(inputPath, aspect, gdal.GDT_Float32, noDataValue)
+    return {"inputPath" : inputPath, "outputPath" : os.path.join(workDir, "ci.tif"), "window" : 1, "aspect" : aspect}
+
+def RunCI(case : dict):
+    Quiet(Convergence_Index.ComputeConvergenceIndex, case["inputPath"], case["outputPath"], case["window"])
+
+def CheckCI(case : dict):
+    window = case["window"]
+    result = ReadRaster(case["outputPath"])
+    assert numpy.allclose(result[window : -window, window : -window], ReferenceCI(case["aspect"], window), atol = 1e-3), "CI differs from reference"
+    assert (result[0 : window, :] == noDataValue).all() and (result[:, 0 : window] == noDataValue).all(), "CI border isn't NoData"
+
+#Longest flow path
+#A comb shaped catchment: every row flows east into the last column, which flows south to the outlet at the bottom right corner.
+#The longest flow path is therefore the first row followed by the last column.
+def SyntheticFDR(size : int, encoding : str):
+    fdr = numpy.full((size, size), fdrDirections[encoding]["E"], dtype = numpy.int16)
+    fdr[:, -1] = fdrDirections[encoding]["S"]
+    expected = numpy.zeros((size, size), dtype = numpy.int16)
+    expected[0, :] = 1
+    expected[:, -1] = 1
+    return fdr, expected
+
+def PrepareLFP(workDir : str, size : int, encoding : str, discrete : bool, useFDRCache : bool = False, useLFPCache : bool = False) -> dict:
+    fdr, expected = SyntheticFDR(size, encoding)
+    inputRasterPath = os.path.join(workDir, "fdr.tif")
+    CreateRaster(inputRasterPath, fdr, gdal.GDT_Int16, fdrNoDataValue)
+
+    outlet = ogr.Geometry(ogr.wkbPoint)
+    outlet.AddPoint(size - 0.5, 0.5) #centre of the bottom right pixel
+    inputOutletsPath = os.path.join(workDir, "outlets.gpkg")
+    CreateVectors(inputOutletsPath, [outlet], ogr.wkbPoint)
+
+    case = {"inputRasterPath" : inputRasterPath, "inputOutletsPath" : inputOutletsPath, "fdrEncoding" : encoding, "useFDRCache" : useFDRCache,
+            "useLFPCache" : useLFPCache, "outputPath" : os.path.join(workDir, "lfp.tif"), "expected" : expected, "discrete" : discrete}
+    if discrete:
+        subcatchment = ogr.CreateGeometryFromWkt(f"POLYGON ((0 0, {size} 0, {size} {size}, 0 {size}, 0 0))")
+        case["inputSubcatchmentsPath"] = os.path.join(workDir, "subcatchments.gpkg")
+        CreateVectors(case["inputSubcatchmentsPath"], [subcatchment], ogr.wkbPolygon)
+
+    return case
+
+#Rectangle of cells [rowStart, rowEnd) x [columnStart, columnEnd) of the synthetic rasters (pixel size 1, size rows), as an ogr polygon.
+def CellsPolygon(rowStart : int, rowEnd : int, columnStart : int, columnEnd : int, size : int):
+    return ogr.CreateGeometryFromWkt(f"POLYGON (({columnStart} {size - rowEnd}, {columnEnd} {size - rowEnd}, {columnEnd} {size - rowStart}, "
+                                     f"{columnStart} {size - rowStart}, {columnStart} {size - rowEnd}))")
+
+#Discrete LFPs of two subcatchments of the comb, both offset from the raster's origin, so that clips' and masks' windows must be mapped
+#back correctly. Each subcatchment's LFP only runs within it, unlike the comb's LFP:
+#   first outlet, at the right end of the last row of a rectangle away from the last column: that row, within the rectangle.
+#   second outlet, at the bottom right corner: the first row of the bottom right quarter, then the last column down from it.
+#The polygons are stored in reverse order of the outlets, so outlets are matched to subcatchments by location rather than order.
+def PrepareSubcatchmentsLFP(workDir : str, size : int, useFDRCache : bool = False, useLFPCache : bool = False) -> dict:
+    case = PrepareLFP(workDir, size, "TauDEM", True, useFDRCache, useLFPCache)
+    quarter = size // 4
+
+    outletCells = [[2 * quarter - 1, 3 * quarter - 1], [size - 1, size - 1]]
+    outlets = []
+    for row, column in outletCells:
+        outlet = ogr.Geometry(ogr.wkbPoint)
+        outlet.AddPoint(column + 0.5, size - row - 0.5)
+        outlets.append(outlet)
+    os.remove(case["inputOutletsPath"])
+    CreateVectors(case["inputOutletsPath"], outlets, ogr.wkbPoint)
+
+    subcatchments = [CellsPolygon(2 * quarter, size, 2 * quarter, size, size), CellsPolygon(quarter, 2 * quarter, quarter, 3 * quarter, size)]
+    os.remove(case["inputSubcatchmentsPath"])
+    CreateVectors(case["inputSubcatchmentsPath"], subcatchments, ogr.wkbPolygon)
+
+    expected = numpy.zeros((size, size), dtype = numpy.int16)
+    expected[2 * quarter - 1, quarter : 3 * quarter] = 1
+    expected[2 * quarter, 2 * quarter :] = 2
+    expected[2 * quarter :, -1] = 2
+    case["expected"] = expected
+
+    return case
+
+def RunLFP(case : dict):
+    if case["discrete"]:
+        Quiet(Discrete_Longest_Flow_Path.ComputeDiscreteLongestFlowPaths, case["inputRasterPath"], case["inputOutletsPath"], case["inputSubcatchmentsPath"],
+              case["fdrEncoding"], case["outputPath"], useFDRCache = case["useFDRCache"], useLFPCache = case["useLFPCache"])
+    else:
+        Quiet(Continuous_Longest_Flow_Path.ComputeLongestFlowPaths, case["inputRasterPath"], case["inputOutletsPath"], case["fdrEncoding"],
+              case["outputPath"], case["useFDRCache"], useLFPCache = case["useLFPCache"])
+
+def CheckLFP(case : dict):
+    result = ReadRaster(case["outputPath"])
+    assert (result == case["expected"]).all(), f"LFP differs from expected path ({numpy.count_nonzero(result)} vs {numpy.count_nonzero(case['expected'])} cells)"
+
+#Samplers
+#Value of pixel (row, column) at day index "day" of the synthetic archives.
+def SyntheticPrecipitation(day : int, size : int):
+    rows, columns = numpy.mgrid[0:size, 0:size]
+    return ((day % 365) + rows * 0.01 + columns * 0.0001).astype(numpy.float32)
+
+#The pixel sampled in both sampler cases, and its centre coordinates
+def SamplerPixel(size : int) -> list:
+    return [size // 3, size // 2]
+
+def SamplerPoint(size : int) -> list:
+    pixel = SamplerPixel(size)
+    return [pixel[1] + 0.5, size - pixel[0] - 0.5]
+
+def PrepareDailySampler(workDir : str, days : int, size : int) -> dict:
+    archiveDir = os.path.join(workDir, "archive")
+    os.makedirs(archiveDir)
+    start = datetime(1983, 1, 1)
+    expected = {}
+    pixel = SamplerPixel(size)
+    for day in range(days):
+        date = start + timedelta(days = day)
+        values = SyntheticPrecipitation(day, size)
+        CreateRaster(os.path.join(archiveDir, f"africa_arc.{date.strftime('%Y%m%d')}.tif"), values, gdal.GDT_Float32, noDataValue)
+        expected[date.strftime("%Y-%m-%d")] = float(values[pixel[0], pixel[1]])
+
+    return {"rastersPath" : archiveDir + "/", "point" : SamplerPoint(size), "outputPath" : os.path.join(workDir, "output.csv"),
+            "expected" : expected, "column" : "Value"}
+
+def PrepareMultibandSampler(workDir : str, years : int, size : int) -> dict:
+    archiveDir = os.path.join(workDir, "archive")
+    os.makedirs(archiveDir)
+    expected = {}
+    pixel = SamplerPixel(size)
+    day = 0
+    for year in range(2000, 2000 + years):
+        bandsCount = (datetime(year + 1, 1, 1) - datetime(year, 1, 1)).days
+        values = numpy.stack([SyntheticPrecipitation(day + doy, size) for doy in range(bandsCount)])
+        CreateRaster(os.path.join(archiveDir, f"{year}.tif"), values, gdal.GDT_Float32, noDataValue)
+        for doy in range(bandsCount):
+            expected[(datetime(year, 1, 1) + timedelta(days = doy)).strftime("%Y-%m-%d")] = float(values[doy, pixel[0], pixel[1]])
+        day += bandsCount
+
+    return {"rastersPath" : archiveDir, "points" : {"point" : SamplerPoint(size)}, "outputPath" : os.path.join(workDir, "output.csv"),
+            "expected" : expected, "column" : "point"}
+
+def RunDailySampler(case : dict):
+    rasters = Quiet(Batch_Raster_Sampler.FindRasters, case["rastersPath"], "*.tif")
+    timeSeries = Batch_Raster_Sampler.SampleTimeSeries(case["point"], rasters)
+    Batch_Raster_Sampler.WriteTimeSeries(timeSeries, case["outputPath"])
+
+def RunMultibandSampler(case : dict):
+    rasters = Quiet(Batch_Raster_Sampler_Multiband.FindRasters, case["rastersPath"], "/*.tif")
+    timeSeries = Quiet(Batch_Raster_Sampler_Multiband.SampleTimeSeries, case["points"], rasters)
+    Quiet(Batch_Raster_Sampler_Multiband.WriteTimeSeries, timeSeries, list(case["points"].keys()), case["outputPath"])
+
+def CheckSampler(case : dict):
+    with open(case["outputPath"]) as output:
+        rows = list(csv.DictReader(output))
+
+    assert [row["Date"] for row in rows] == list(case["expected"].keys()), "sampled dates differ from the archive's"
+    for row in rows:
+        assert abs(float(row[case["column"]]) - case["expected"][row["Date"]]) <= 0.005 + 1e-6, f"sampled value differs at {row['Date']}"
+
+#name : [prepare(workDir, sizes), run(case), check(case)]
+#The _dag cases build the LFP cache (see LFP_Cache.py) in their first run, so with --repeat > 1 the best run times the extraction from it.
+#The discrete _mmap cases mask the subcatchments from the padded FDR cache instead of clipping them. They are checked against the same
+#expected paths as the clipping cases, so both modes must agree.
+cases = {"ci" :                         [lambda workDir, size : PrepareCI(workDir, size["ci"]), RunCI, CheckCI],
+         "lfp_continuous" :             [lambda workDir, size : PrepareLFP(workDir, size["lfp"], "TauDEM", False), RunLFP, CheckLFP],
+         "lfp_continuous_grass" :       [lambda workDir, size : PrepareLFP(workDir, size["lfp"], "GRASS", False), RunLFP, CheckLFP],
+         "lfp_continuous_mmap" :        [lambda workDir, size : PrepareLFP(workDir, size["lfp"], "TauDEM", False, True), RunLFP, CheckLFP],
+         "lfp_continuous_dag" :         [lambda workDir, size : PrepareLFP(workDir, size["lfp"], "TauDEM", False, useLFPCache = True), RunLFP, CheckLFP],
+         "lfp_discrete" :               [lambda workDir, size : PrepareLFP(workDir, size["lfp"], "TauDEM", True), RunLFP, CheckLFP],
+         "lfp_discrete_mmap" :          [lambda workDir, size : PrepareLFP(workDir, size["lfp"], "TauDEM", True, True), RunLFP, CheckLFP],
+         "lfp_discrete_dag" :           [lambda workDir, size : PrepareLFP(workDir, size["lfp"], "TauDEM", True, useLFPCache = True), RunLFP, CheckLFP],
+         "lfp_subcatchments" :          [lambda workDir, size : PrepareSubcatchmentsLFP(workDir, size["lfp"]), RunLFP, CheckLFP],
+         "lfp_subcatchments_mmap" :     [lambda workDir, size : PrepareSubcatchmentsLFP(workDir, size["lfp"], True), RunLFP, CheckLFP],
+         "lfp_subcatchments_dag" :      [lambda workDir, size : PrepareSubcatchmentsLFP(workDir, size["lfp"], useLFPCache = True), RunLFP, CheckLFP],
+         "lfp_subcatchments_mmap_dag" : [lambda workDir, size : PrepareSubcatchmentsLFP(workDir, size["lfp"], True, True), RunLFP, CheckLFP],
+         "sampler_daily" :              [lambda workDir, size : PrepareDailySampler(workDir, size["dailyDays"], size["dailySize"]), RunDailySampler, CheckSampler],
+         "sampler_multiband" :          [lambda workDir, size : PrepareMultibandSampler(workDir, size["multibandYears"], size["multibandSize"]), RunMultibandSampler, CheckSampler]}
+
+def LoadBaselines() -> dict:
+    if not os.path.exists(baselinesPath):
+        return {}
+    with open(baselinesPath) as baselinesFile:
+        return json.load(baselinesFile)
+
+def Main():
+    parser = argparse.ArgumentParser(description = "Benchmark the scripts' hot paths on synthetic inputs")
+    parser.add_argument("--sizes", nargs = "+", choices = list(sizes.keys()), default = ["small", "medium"])
+    parser.add_argument("--cases", nargs = "+", choices = list(cases.keys()), default = list(cases.keys()))
+    parser.add_argument("--repeat", type = int, default = 3, help = "runs per case, the best one is reported")
+    parser.add_argument("--tolerance", type = float, default = 1.5, help = "max allowed ratio of time over baseline")
+    parser.add_argument("--save-baseline", action = "store_true", help = f"store the timings in {baselinesPath}")
+    parser.add_argument("--require-baseline", action = "store_true", help = "fail cases that have no baseline")
+    args = parser.parse_args()
+
+    baselines = LoadBaselines()
+    failures = []
+    missing = []
+
+    print (f"{'case':<40}{'best (s)':>12}{'baseline (s)':>14}{'ratio':>8}")
+    for sizeName in args.sizes:
+        for caseName in args.cases:
+            key = f"{caseName}[{sizeName}]"
+            prepare, run, check = cases[caseName]
+            workDir = tempfile.mkdtemp(prefix = "hot_path_benchmark_")
+            try:
+                case = prepare(workDir, sizes[sizeName])
+                times = []
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    run(case)
+                    times.append(time.perf_counter() - start)
+                    check(case)
+            except Exception as error: #a failing check, or any error raised by the case, fails that case only
+                failures.append(f"{key}: {type(error).__name__}: {error}")
+                print (f"{key:<40}{'FAILED':>12}")
+                continue
+            finally:
+                shutil.rmtree(workDir)
+
+            best = min(times)
+            baseline = baselines.get(key)
+            if baseline is None:
+                print (f"{key:<40}{best:>12.3f}{'MISSING':>14}{'-':>8}")
+                if not args.save_baseline:
+                    (failures if args.require_baseline else missing).append(f"{key}: no baseline to compare against")
+            else:
+                print (f"{key:<40}{best:>12.3f}{baseline:>14.3f}{best / baseline:>8.2f}")
+                if best / baseline > args.tolerance and not args.save_baseline:
+                    failures.append(f"{key}: {best:.3f}s is {best / baseline:.2f}x the baseline of {baseline:.3f}s")
+
+            if args.save_baseline:
+                baselines[key] = best
+
+    if args.save_baseline:
+        with open(baselinesPath, "w") as baselinesFile:
+            json.dump(dict(sorted(baselines.items())), baselinesFile, indent = 4)
+        print (f"Saved baselines to {baselinesPath}")
+
+    for case in missing:
+        print (f"MISSING {case}")
+    if len(missing) > 0:
+        print ("Timings weren't compared for these, store baselines with --save-baseline on this machine")
+    for failure in failures:
+        print (f"FAILED {failure}")
+    sys.exit(1 if len(failures) > 0 else 0)
+
+if __name__ == "__main__":
+    Main()
@@ -0,0 +1,98 @@
+#Compares sampling a point's time series from a daily raster archive (one file per day, as Batch_Raster_Sampler.py does it) against
+#the two time stack layouts in Scripts/Time_Stack.py (VRT and time-contiguous GTiff cube).
+#A synthetic archive is generated in a temporary directory, so this runs offline and leaves nothing behind.
+#Usage: python Time_Stack_Benchmark.py [--days 1461] [--size 256] [--points 5]
+
+import argparse, os, sys, tempfile, time, shutil
+import numpy
+from osgeo import gdal
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Scripts"))
+from Time_Stack import BuildTimeStack, SampleTimeStack
+
+gdal.UseExceptions()
+
+#Value of pixel (row, column) on day index "day". Unique enough per day and pixel to catch any mix up of dates or pixels.
+def SyntheticValue(day, row, column):
+    return numpy.float32((day % 365) + row * 0.01 + column * 0.0001)
+
+def CreateSyntheticArchive(archiveDir : str, days : int, size : int) -> list:
+    rows, columns = numpy.mgrid[0:size, 0:size]
+    start = datetime(1983, 1, 1)
+    driver = gdal.GetDriverByName("GTiff")
+
+    sources = []
+    for day in range(days):
+        date = (start + timedelta(days = day)).strftime("%Y-%m-%d")
+        rasterPath = os.path.join(archiveDir, f"africa_arc.{date.replace('-', '')}.tif")
+        raster = driver.Create(rasterPath, xsize = size, ysize = size, bands = 1, eType = gdal.GDT_Float32)
+        raster.SetGeoTransform([0.0, 0.1, 0.0, size * 0.1, 0.0, -0.1])
+        raster.GetRasterBand(1).SetNoDataValue(-9999.0)
+        raster.GetRasterBand(1).WriteArray(SyntheticValue(day, rows, columns).astype(numpy.float32))
+        raster = None
+        sources.append([date, rasterPath, 1])
+
+    return sources
+
+#Same approach as SamplePoint() in Batch_Raster_Sampler.py: open each raster and read its band.
+def SamplePerFile(sources : list, points : dict) -> dict:
+    timeSeries = {}
+    for date, rasterPath, band in sources:
+        raster = gdal.Open(rasterPath, gdal.GA_ReadOnly)
+        transformations = raster.GetGeoTransform()
+        bandArray = raster.GetRasterBand(band).ReadAsArray()
+        timeSeries[date] = {}
+        for pointID in points.keys():
+            x = int((points[pointID][0] - transformations[0]) / transformations[1])
+            y = int(-1 * (transformations[3] - points[pointID][1]) / transformations[5])
+            timeSeries[date][pointID] = bandArray[y][x]
+
+    return timeSeries
+
+def Timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+def Main():
+    parser = argparse.ArgumentParser(description = "Benchmark per-file sampling against time stack layouts")
+    parser.add_argument("--days", type = int, default = 1461, help = "number of daily rasters in the synthetic archive")
+    parser.add_argument("--size", type = int, default = 256, help = "width and height of each raster in pixels")
+    parser.add_argument("--points", type = int, default = 5, help = "number of points to sample")
+    args = parser.parse_args()
+
+    workDir = tempfile.mkdtemp(prefix = "time_stack_benchmark_")
+    try:
+        print (f"Generating {args.days} rasters of {args.size} x {args.size} in {workDir}")
+        sources = CreateSyntheticArchive(workDir, args.days, args.size)
+
+        generator = numpy.random.default_rng(0)
+        pixels = generator.integers(0, args.size, size = (args.points, 2))
+        #pixel centres, in the synthetic rasters' CRS
+        points = {f"point_{i}" : [(pixel[1] + 0.5) * 0.1, (args.size - pixel[0] - 0.5) * 0.1] for i, pixel in enumerate(pixels)}
+
+        reference, perFileTime = Timed(SamplePerFile, sources, points)
+        print (f"{'layout':<10}{'build (s)':>12}{'sample (s)':>12}{'speedup':>10}")
+        print (f"{'per-file':<10}{0.0:>12.3f}{perFileTime:>12.3f}{1.0:>10.1f}")
+
+        for stackFormat, extension in [["VRT", ".vrt"], ["GTiff", ".tif"]]:
+            stackPath = os.path.join(workDir, "time_stack" + extension)
+            _, buildTime = Timed(BuildTimeStack, sources, stackPath, stackFormat)
+
+            #reopen, so the sampling time includes opening the stack as a real run would
+            def OpenAndSample():
+                return SampleTimeStack(gdal.Open(stackPath, gdal.GA_ReadOnly), points)
+            stackSeries, sampleTime = Timed(OpenAndSample)
+
+            assert list(stackSeries.keys()) == list(reference.keys()), f"{stackFormat} stack dates don't match the archive"
+            for date in reference.keys():
+                for pointID in points.keys():
+                    assert stackSeries[date][pointID] == reference[date][pointID], f"{stackFormat} mismatch at {date}, {pointID}"
+
+            print (f"{stackFormat:<10}{buildTime:>12.3f}{sampleTime:>12.3f}{perFileTime / sampleTime:>10.1f}")
+    finally:
+        shutil.rmtree(workDir)
+
+if __name__ == "__main__":
+    Main()
@@ -0,0 +1,25 @@
+#pytest-benchmark front end to the cases of Hot_Path_Benchmark.py, so runs can be stored and compared with pytest-benchmark's tooling.
+#Usage, from the repository's root:
+#   pytest Benchmarks --benchmark-autosave                                      #store this run under .benchmarks/ as a baseline
+#   pytest Benchmarks --benchmark-compare --benchmark-compare-fail=min:50%      #fail cases more than 50% slower than the last stored run
+#   pytest Benchmarks -k "lfp and small"                                        #only some cases
+#Skipped if pytest-benchmark or GDAL aren't installed.
+
+import os, sys
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+pytest.importorskip("osgeo")
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import Hot_Path_Benchmark
+
+@pytest.mark.parametrize("sizeName", ["small", "medium"])
+@pytest.mark.parametrize("caseName", list(Hot_Path_Benchmark.cases.keys()))
+def test_HotPath(benchmark, tmp_path, caseName : str, sizeName : str):
+    prepare, run, check = Hot_Path_Benchmark.cases[caseName]
+    case = prepare(str(tmp_path), Hot_Path_Benchmark.sizes[sizeName])
+
+    benchmark.group = caseName
+    benchmark.pedantic(run, args = (case,), rounds = 3, iterations = 1)
+    check(case)
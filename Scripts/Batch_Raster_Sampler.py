@@ -1,28 +1,16 @@
 #This script is made to extract time series for a single point from multiple precipitation rasters on disk (but can be used for any
 #similar dataset). This specific script is meant for datasets with daily temporal resolution split into one raster for each day.
 #The rasters must be extracted and named systematically. The name must contain the year, month and date (directly or indirectly)
-#Adjust the ExtractDateStringFromName(filename : str) for each dataset naming scheme.
-#Adjust the searchGlob variable 
+#Adjust the ExtractDateStringFromName(filename : str) for each dataset naming scheme (or pass your own to FindRasters()).
+#Can be imported (SampleArray() works on numpy arrays, SampleTimeSeries() on the rasters) or run from the command line:
+#   python Batch_Raster_Sampler.py /path/to/rasters/root/dir/ -1.234 5.678 --glob "*.tif" --output output.csv
 
 #TODO add sampling methods other than NN.
 
-import glob, os
+import glob, os, argparse
 from osgeo import gdal
-
-#Inputs
-pointToSample = [-1.234, 5.678] #x, y coordiantes. Must match rasters' CRS
-
-rastersPath = "/path/to/rasters/root/dir/"
-
-#The string searchGlob is appended to rastersPath to create the search glob wildcard.
-#If for example your rasters all all in the root of rasterPath directory, then "*.tif" is enough to include all tifs in it.
-#If the rasters are split between multiple subdirectories, then "*/*.tif" may be used to traverse these subdirs.
-#See Python Glob function for more details.
-searchGlob = "*.tif" 
-
-
-outputPath = os.path.dirname(__file__) + "/output.csv"
-precision = 2 #max number of decimal digits to be written in the output
+from Time_Stack import OpenTimeStack, SampleTimeStack, timeStackExtensions
+import Instrumentation
 
 #Adjust this function depending on the format of the file name.
 #This function is supposed to return a string "year-month-date", e.g. "2000-08-16"
@@ -30,45 +18,99 @@ def ExtractDateStringFromName(fileName : str) -> str:
     #This implementation is for CHIPRS daily datasets with filenames like "chirps-v2.0.2001.09.03.tif"
     # splitString = fileName.split(".")
     # return "-".join([splitString[2], splitString[3], splitString[4]])
-    
+
     #This implementation is for ARC v2 filename like: "africa_arc.19830115.tif"
     splitString = fileName.split(".")[1]
     return f"{splitString[:4]}-{splitString[4:6]}-{splitString[6:8]}"
 
-
 #Processing
-#Practically a nearest neighbour sampler
-def SamplePoint(point, rasterPath) -> float:
-    raster = gdal.Open(rasterPath, gdal.GA_ReadOnly)
-    transformations = raster.GetGeoTransform() #anchor coord x and y = 0 and 3, pixelSizeX = 1, pixelSizeY = 5
-
-    #get image space coordinate of point
+#Returns the image space [y, x] of a point given its raster's transformations (anchor coord x and y = 0 and 3, pixelSizeX = 1, pixelSizeY = 5)
+def GeoCoordToPixel(point : list, transformations : list) -> list:
     x = int((point[0] - transformations[0]) / transformations[1])
     y = int(-1 * (transformations[3] - point[1]) / transformations[5])
+    return [y, x]
 
-    return round(raster.GetRasterBand(1).ReadAsArray()[y][x], precision)
-
-#Create a dictionary of rasters to sample
-rasters = {}
-
-for file in glob.glob(rastersPath + searchGlob):
-    fileName = os.path.split(file)[1]
-    rasters[ExtractDateStringFromName(fileName)] = file
-
-print (f"Found {len(rasters)} rasters")
-
-#sort the list based on the date (key) to make the output easier to use (Doesn't work on older python versions, I think)
-rasters = dict(sorted(rasters.items()))
+#Practically a nearest neighbour sampler
+def SampleArray(array, transformations : list, point : list, precision : int = 2) -> float:
+    y, x = GeoCoordToPixel(point, transformations)
+    return round(array[y][x], precision)
 
-#Loop over dictionary and sample the time series
-timeSeries = {}
+def SamplePoint(point, rasterPath, precision : int = 2) -> float:
+    raster = gdal.Open(rasterPath, gdal.GA_ReadOnly)
+    return SampleArray(raster.GetRasterBand(1).ReadAsArray(), raster.GetGeoTransform(), point, precision)
 
-for key in rasters:
-    rasterPath = rasters[key]
-    timeSeries[key] = SamplePoint(pointToSample, rasterPath)
+#Create a dictionary of rasters to sample, date then path, sorted by date.
+#The string searchGlob is appended to rastersPath to create the search glob wildcard.
+#If for example your rasters all all in the root of rasterPath directory, then "*.tif" is enough to include all tifs in it.
+#If the rasters are split between multiple subdirectories, then "*/*.tif" may be used to traverse these subdirs.
+#See Python Glob function for more details.
+def FindRasters(rastersPath : str, searchGlob : str = "*.tif", excludedPaths : list = [], extractDateString = ExtractDateStringFromName) -> dict:
+    rasters = {}
+    excludedPaths = [os.path.abspath(excludedPath) for excludedPath in excludedPaths]
+
+    for file in glob.glob(rastersPath + searchGlob):
+        if os.path.abspath(file) in excludedPaths:
+            continue
+        fileName = os.path.split(file)[1]
+        rasters[extractDateString(fileName)] = file
+
+    print (f"Found {len(rasters)} rasters")
+
+    #sort the list based on the date (key) to make the output easier to use (Doesn't work on older python versions, I think)
+    return dict(sorted(rasters.items()))
+
+#Loop over dictionary and sample the time series. Returns a dict, date then value.
+#If timeStackPath is given, a stacked dataset with one band per date is built over the archive once (and reused in subsequent runs)
+#at that path, and the whole series is sampled with a single read instead of opening every raster (see Time_Stack.py).
+#timeStackFormat is either "VRT" (fast to build, still reads each file behind it) or "GTiff" (time-contiguous cube, fastest to sample)
+def SampleTimeSeries(point : list, rasters : dict, precision : int = 2, timeStackPath : str = None, timeStackFormat : str = "GTiff",
+                     rebuildTimeStack : bool = False) -> dict:
+    timeSeries = {}
+
+    if timeStackPath is not None:
+        stack = OpenTimeStack([[key, rasters[key], 1] for key in rasters], timeStackPath, timeStackFormat, rebuildTimeStack)
+        with Instrumentation.Stage("sampleTimeStack", file = timeStackPath) as record:
+            stackSeries = SampleTimeStack(stack, {"point" : point})
+            record["cells"] = len(stackSeries)
+        for key in stackSeries:
+            timeSeries[key] = round(stackSeries[key]["point"], precision)
+    else:
+        for key in rasters:
+            rasterPath = rasters[key]
+            with Instrumentation.Stage("sampleRaster", file = rasterPath, cells = 1):
+                timeSeries[key] = SamplePoint(point, rasterPath, precision)
+
+    return timeSeries
 
 #Write timeseries to disk
-with open(outputPath, "w") as output:
-    output.write("Date,Value\n")
-    for key in timeSeries:
-        output.write(f"{key},{str(timeSeries[key])}\n") #str(timeseries[key]) to force output of rounded precision above, else it would output entire float64(?) decimals.
+def WriteTimeSeries(timeSeries : dict, outputPath : str):
+    with open(outputPath, "w") as output:
+        output.write("Date,Value\n")
+        for key in timeSeries:
+            output.write(f"{key},{str(timeSeries[key])}\n") #str(timeseries[key]) to force output of rounded precision above, else it would output entire float64(?) decimals.
+
+def Main():
+    parser = argparse.ArgumentParser(description = "Extract the time series of a point from a directory of daily rasters")
+    parser.add_argument("rastersPath", help = "root directory of the rasters (the glob is appended to it)")
+    parser.add_argument("x", type = float, help = "x coordinate of the point, must match rasters' CRS")
+    parser.add_argument("y", type = float, help = "y coordinate of the point, must match rasters' CRS")
+    parser.add_argument("--glob", dest = "searchGlob", default = "*.tif", help = "search glob appended to rastersPath")
+    parser.add_argument("--output", dest = "outputPath", default = os.path.dirname(os.path.abspath(__file__)) + "/output.csv", help = "output CSV path")
+    parser.add_argument("--precision", type = int, default = 2, help = "max number of decimal digits to be written in the output")
+    parser.add_argument("--time-stack", dest = "timeStackFormat", choices = list(timeStackExtensions.keys()), default = None,
+                        help = "build (or reuse) a time stack of this format over the archive and sample it instead (see Time_Stack.py)")
+    parser.add_argument("--rebuild-time-stack", dest = "rebuildTimeStack", action = "store_true", help = "force rebuilding the time stack")
+    Instrumentation.AddArguments(parser)
+    args = parser.parse_args()
+
+    #time stacks live next to the archive, never sample them as part of it
+    timeStackPaths = {stackFormat : args.rastersPath + "time_stack" + timeStackExtensions[stackFormat] for stackFormat in timeStackExtensions}
+    timeStackPath = None if args.timeStackFormat is None else timeStackPaths[args.timeStackFormat]
+
+    with Instrumentation.FromArguments(args, "Batch_Raster_Sampler"):
+        rasters = FindRasters(args.rastersPath, args.searchGlob, list(timeStackPaths.values()))
+        timeSeries = SampleTimeSeries([args.x, args.y], rasters, args.precision, timeStackPath, args.timeStackFormat, args.rebuildTimeStack)
+        WriteTimeSeries(timeSeries, args.outputPath)
+
+if __name__ == "__main__":
+    Main()
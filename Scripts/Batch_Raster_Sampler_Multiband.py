@@ -1,11 +1,13 @@
-#This script is made to extract time series for a single point from multiple, multiband precipitation rasters on disk (but can be used 
-#for any similar dataset). 
+#This script is made to extract time series for a single point from multiple, multiband precipitation rasters on disk (but can be used
+#for any similar dataset).
 #This implementation assumes daily data is stored in the bands of each raster in a "day of the year" fashion. i.e. the first band
 #is DoY = 1 -> January 1st, second band is DoY = 2 -> January 2nd, and so on.
 #The rasters must be extracted and named systematically. The name must contain the year.
 #Adjust the ExtractDateStringFromName(filename : str) for each dataset naming scheme.
 #Note: while some dataset (e.g. GPCC daily) is distributed as NCDF, this code was note tested for this format. You may need to convert
 #them to multiband geotiffs using QGIS.
+#Can be imported (SampleArray() works on numpy arrays, SampleTimeSeries() on the rasters) or run from the command line:
+#   python Batch_Raster_Sampler_Multiband.py /path/to/raster --point point_1_eg 0.5 1.5 --point point_2_eg 1.0 1.5 --output outputFile.csv
 
 #TODO add sampling methods other than NN.
 
@@ -13,94 +15,156 @@ from glob import glob
 from os import path
 from osgeo import gdal
 from datetime import datetime, timedelta
-
-#Inputs
-#pointsToSample is a dict with key = point name (to be used in output, must be unique), and value = coordinates of the point. must be in same CRS as rasters
-#TODO add option to import points from vectors files (gpkg, shp, etc)
-pointsToSample = {"point_1_eg" : [0.5, 1.5],
-                  "point_2_eg" : [1.0, 1.5],
-                  "point_3_eg" : [-0.5, 1.0]}
-
-
-
-rastersPath = "/path/to/raster"
-#The string searchGlob is appended to rastersPath to create the search glob wildcard.
-#If for example your rasters all all in the root of rasterPath directory, then "/*.tif" is enough to include all tifs in it.
-#If the rasters are split between multiple subdirectories, then "*/*.tif" may be used to traverse these subdirs.
-#See Python Glob function for more details.
-searchGlob = "/*.tif" 
-
-outputPath = path.dirname(__file__) + "/outputFile.csv"
-precision = 2 #max number of decimal digits to be written in the output
+import argparse
+from Time_Stack import OpenTimeStack, SampleTimeStack, timeStackExtensions
+import Instrumentation
 
 #Adjust this function depending on the format of the file name
 #This implementation assumes the files to take the name "year.tif", e.g. "2000.tif"
-def ExtractDateStringFromName(fileName : str) -> str: 
+def ExtractDateStringFromName(fileName : str) -> str:
     splitString = fileName.split(".")
     return splitString[0]
 
 #Processing
-#Practically a nearest neighbour sampler
-def SamplePoints(points : dict, rasterPath : str) -> dict:
-    raster = gdal.Open(rasterPath, gdal.GA_ReadOnly)
-    bandsCount = raster.RasterCount
-    transformations = raster.GetGeoTransform() #anchor coord x and y = 0 and 3, pixelSizeX = 1, pixelSizeY = 5
-    
+#Returns a dict with key = point ID and value = image space [y, x] of the point, given the raster's transformations
+#(anchor coord x and y = 0 and 3, pixelSizeX = 1, pixelSizeY = 5)
+def GeoCoordsToPixels(points : dict, transformations : list) -> dict:
     pixels = {}
     for pointID in points.keys():
         geoRefCoords = points[pointID]
         x = int((geoRefCoords[0] - transformations[0]) / transformations[1])
         y = int(-1 * (transformations[3] - geoRefCoords[1]) / transformations[5])
         pixels[pointID] = [y, x]
-    
+
+    return pixels
+
+#Practically a nearest neighbour sampler. pixels as returned by GeoCoordsToPixels(). Returns a dict, pointID then value.
+def SampleArray(array, pixels : dict, precision : int = 2) -> dict:
+    values = {}
+    for pointID in pixels.keys():
+        pixel = pixels[pointID]
+        values[pointID] = round(array[pixel[0]][pixel[1]], precision)
+
+    return values
+
+#points is a dict with key = point name (to be used in output, must be unique), and value = coordinates of the point. must be in same CRS as rasters
+def SamplePoints(points : dict, rasterPath : str, precision : int = 2) -> dict:
+    raster = gdal.Open(rasterPath, gdal.GA_ReadOnly)
+    bandsCount = raster.RasterCount
+    pixels = GeoCoordsToPixels(points, raster.GetGeoTransform())
+
     yearStart = datetime(int(ExtractDateStringFromName(fileName = path.split(rasterPath)[1])), 1, 1)
-    
+
     yearTS = {} #dict of dicts, date then pointID
     for doy in range (1, bandsCount+1):
         rasterArray = raster.GetRasterBand(doy).ReadAsArray()
         date = (yearStart + timedelta(days = (doy - 1))).strftime("%Y-%m-%d")
-        yearTS[date] = {}
-        for pointID in pixels.keys():
-            pixel = pixels[pointID]
-            value = round(rasterArray[pixel[0]][pixel[1]], precision)
-            yearTS[date][pointID] = value
-    
-    return yearTS
-    
-
-#Create a dictionary of rasters to sample
-rasters = []
+        yearTS[date] = SampleArray(rasterArray, pixels, precision)
 
-for file in glob(rastersPath + searchGlob):
-    rasters.append(file)
-
-print (f"Found {len(rasters)} rasters")
+    return yearTS
 
-#Loop over dictionary and sample the time series
-timeSeries = {} #dict of dicts, date then pointID
+#Returns a list of [date, rasterPath, band] for every band of every raster, sorted by date, to build the time stack from.
+def ListTimeStackSources(rasterPaths : list) -> list:
+    sources = []
+    for rasterPath in rasterPaths:
+        bandsCount = gdal.Open(rasterPath, gdal.GA_ReadOnly).RasterCount
+        yearStart = datetime(int(ExtractDateStringFromName(fileName = path.split(rasterPath)[1])), 1, 1)
+        for doy in range (1, bandsCount+1):
+            date = (yearStart + timedelta(days = (doy - 1))).strftime("%Y-%m-%d")
+            sources.append([date, rasterPath, doy])
 
-for raster in rasters:
-    print (f"Sampling raster {raster}")
-    timeSeries = {**timeSeries, **SamplePoints(pointsToSample, raster)}
+    return sorted(sources)
 
-print (f"Sorting time series")
-timeSeries = dict(sorted(timeSeries.items()))
+#Create a list of rasters to sample
+#The string searchGlob is appended to rastersPath to create the search glob wildcard.
+#If for example your rasters all all in the root of rasterPath directory, then "/*.tif" is enough to include all tifs in it.
+#If the rasters are split between multiple subdirectories, then "*/*.tif" may be used to traverse these subdirs.
+#See Python Glob function for more details.
+def FindRasters(rastersPath : str, searchGlob : str = "/*.tif", excludedPaths : list = []) -> list:
+    rasters = []
+    excludedPaths = [path.abspath(excludedPath) for excludedPath in excludedPaths]
+
+    for file in glob(rastersPath + searchGlob):
+        if path.abspath(file) in excludedPaths:
+            continue
+        rasters.append(file)
+
+    print (f"Found {len(rasters)} rasters")
+    return rasters
+
+#Loop over the rasters and sample the time series. Returns a dict of dicts, date then pointID, sorted by date.
+#If timeStackPath is given, a stacked dataset with one band per date (i.e. all bands of all rasters) is built over the archive once
+#(and reused in subsequent runs) at that path, and the whole series of each point is sampled with a single read instead of reading
+#every band of every raster (see Time_Stack.py).
+#timeStackFormat is either "VRT" (fast to build, still reads each file behind it) or "GTiff" (time-contiguous cube, fastest to sample)
+def SampleTimeSeries(points : dict, rasters : list, precision : int = 2, timeStackPath : str = None, timeStackFormat : str = "GTiff",
+                     rebuildTimeStack : bool = False) -> dict:
+    timeSeries = {} #dict of dicts, date then pointID
+
+    if timeStackPath is not None:
+        stack = OpenTimeStack(ListTimeStackSources(rasters), timeStackPath, timeStackFormat, rebuildTimeStack)
+        print (f"Sampling time stack {timeStackPath}")
+        with Instrumentation.Stage("sampleTimeStack", file = timeStackPath) as record:
+            timeSeries = SampleTimeStack(stack, points)
+            record["cells"] = len(timeSeries) * len(points)
+        for date in timeSeries.keys():
+            for pointID in timeSeries[date].keys():
+                timeSeries[date][pointID] = round(timeSeries[date][pointID], precision)
+    else:
+        for raster in rasters:
+            print (f"Sampling raster {raster}")
+            with Instrumentation.Stage("sampleRaster", file = raster) as record:
+                yearTS = SamplePoints(points, raster, precision)
+                record["cells"] = len(yearTS) * len(points)
+            timeSeries = {**timeSeries, **yearTS}
+
+    print (f"Sorting time series")
+    return dict(sorted(timeSeries.items()))
 
 #Write timeseries to disk
-print (f"Writing results to {outputPath}")
-with open(outputPath, "w") as output:
-    header = "Date"
-    pointIDs = pointsToSample.keys()
-    print (f"point IDs : {pointIDs}")
-    for pointID in  pointsToSample:
-        header += f",{pointID}"
-    header += "\n" #add breakline
-    output.write(header)
-
-    for date in timeSeries.keys():
-        line = date
+def WriteTimeSeries(timeSeries : dict, pointIDs : list, outputPath : str):
+    print (f"Writing results to {outputPath}")
+    with open(outputPath, "w") as output:
+        header = "Date"
+        print (f"point IDs : {pointIDs}")
         for pointID in pointIDs:
-            line += "," + str(timeSeries[date][pointID]) #str(timeseries[key]) to force output of rounded precision above, else it would output entire float64(?) decimals.
-        line += "\n"
-
-        output.write(line)
+            header += f",{pointID}"
+        header += "\n" #add breakline
+        output.write(header)
+
+        for date in timeSeries.keys():
+            line = date
+            for pointID in pointIDs:
+                line += "," + str(timeSeries[date][pointID]) #str(timeseries[key]) to force output of rounded precision above, else it would output entire float64(?) decimals.
+            line += "\n"
+
+            output.write(line)
+
+def Main():
+    parser = argparse.ArgumentParser(description = "Extract the time series of points from a directory of yearly, multiband (one band per day) rasters")
+    parser.add_argument("rastersPath", help = "directory of the rasters (the glob is appended to it)")
+    parser.add_argument("--point", dest = "points", nargs = 3, action = "append", required = True, metavar = ("ID", "X", "Y"),
+                        help = "a point to sample, its ID must be unique, coordinates must be in the rasters' CRS. Can be repeated")
+    parser.add_argument("--glob", dest = "searchGlob", default = "/*.tif", help = "search glob appended to rastersPath")
+    parser.add_argument("--output", dest = "outputPath", default = path.dirname(path.abspath(__file__)) + "/outputFile.csv", help = "output CSV path")
+    parser.add_argument("--precision", type = int, default = 2, help = "max number of decimal digits to be written in the output")
+    parser.add_argument("--time-stack", dest = "timeStackFormat", choices = list(timeStackExtensions.keys()), default = None,
+                        help = "build (or reuse) a time stack of this format over the archive and sample it instead (see Time_Stack.py)")
+    parser.add_argument("--rebuild-time-stack", dest = "rebuildTimeStack", action = "store_true", help = "force rebuilding the time stack")
+    Instrumentation.AddArguments(parser)
+    args = parser.parse_args()
+
+    #TODO add option to import points from vectors files (gpkg, shp, etc)
+    pointsToSample = {pointID : [float(x), float(y)] for pointID, x, y in args.points}
+
+    #time stacks live next to the archive, never sample them as part of it
+    timeStackPaths = {stackFormat : args.rastersPath + "/time_stack" + timeStackExtensions[stackFormat] for stackFormat in timeStackExtensions}
+    timeStackPath = None if args.timeStackFormat is None else timeStackPaths[args.timeStackFormat]
+
+    with Instrumentation.FromArguments(args, "Batch_Raster_Sampler_Multiband"):
+        rasters = FindRasters(args.rastersPath, args.searchGlob, list(timeStackPaths.values()))
+        timeSeries = SampleTimeSeries(pointsToSample, rasters, args.precision, timeStackPath, args.timeStackFormat, args.rebuildTimeStack)
+        WriteTimeSeries(timeSeries, list(pointsToSample.keys()), args.outputPath)
+
+if __name__ == "__main__":
+    Main()
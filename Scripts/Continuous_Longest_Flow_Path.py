@@ -1,81 +1,88 @@
-#This script computes the longest flow path given a flow direction map (currently in TauDEM format) and outlet points ogr file
-#This script doesn't cater for successive subcatchments (i.e. those downstream of others), and the lfp would simply match the 
+#This script computes the longest flow path given a flow direction map (TauDEM or GRASS format) and outlet points ogr file
+#This script doesn't cater for successive subcatchments (i.e. those downstream of others), and the lfp would simply match the
 #delineated streamline for D/S subs. See the Discrete version of this script for that case.
+#Can be imported (TraceLFP() and RasteriseLFPs() work on numpy arrays, ComputeLongestFlowPaths() on files) or run from the command line:
+#   python Continuous_Longest_Flow_Path.py /path/to/fdr.tif /path/to/outlets.gpkg --encoding TauDEM [--lfp-cache]
 
 from osgeo import gdal, ogr
-import numpy, sys, os
+import numpy, math, sys, os, argparse
+from FDR_Cache import LoadPaddedFDR
+from LFP_Cache import FDRChecksum, UpstreamCacheKey, IsUpstreamCacheCurrent, LoadUpstreamGrids, WriteUpstreamGrids
+import Instrumentation, Output_Raster
 
 sys.setrecursionlimit(50000) #TODO this is a stupid hack to workaround the naivete of the recurssion implementation
 #Most likely will cause a stack overflow somewhere. Try bumping the limit up for large watersheds (or downsample them)
 #TODO implement file existence checks and handling I/O exceptions
 
-#Inputs
-#FDR raster
-inputRasterPath = "path\\here"
-#Outlets OGR file
-inputOutletsPath = "path\\here"
-
-#Value a pixel must have to be considered pouring to the central cell. From left to right, top to bottom.
-usNeighboursFDR = numpy.array([[8, 7, 6], [1, 0, 5], [2, 3, 4]]) 
+#Value a pixel must have to be considered pouring to the central cell, for each convention. From left to right, top to bottom.
 #TauDEM flow direction convention for FDR: 1 -East, 2 - Northeast, 3 - North, 4 - Northwest, 5 - West, 6 - Southwest, 7 - South, 8 - Southeast.
-#TODO add GRASS, ArcHydro/GIS/map, etc's conventions, plus means to pick which one to use.
+#GRASS (r.watershed) convention: 1 - Northeast, 2 - North, 3 - Northwest, 4 - West, 5 - Southwest, 6 - South, 7 - Southeast, 8 - East.
+#(negative GRASS values, for flow leaving the region, never match and are treated as sources)
+usNeighboursFDRConventions = {"TauDEM" : numpy.array([[8, 7, 6], [1, 0, 5], [2, 3, 4]]),
+                              "GRASS" : numpy.array([[7, 6, 5], [8, 0, 4], [1, 2, 3]])}
+#TODO add ArcHydro/GIS/map, etc's conventions.
+
+#defs
+#Returns the gdal dataset of the FDR and its values, padded with NoData to avoid adding boundary check for the edges. Note that
+#coordinates in the padded array are shifted by (1,1).
+#If useFDRCache is True, the padded FDR is cached once as an uncompressed .npy file (at fdrCachePath, defaults to next to the FDR)
+#and memory-mapped in this and later runs (see FDR_Cache.py), instead of reading and padding the whole raster in memory.
+def LoadInputRaster(inputRasterPath : str, useFDRCache : bool = False, fdrCachePath : str = None):
+    raster = gdal.Open(inputRasterPath, gdal.GA_ReadOnly)
 
-#cached parameters
-raster = None #ref to the gdal dataset containing the raster
-fdr = None #numpy array containing the raster's values
-inputRasterExtents = [] #minX, minY, maxX, maxY. Note: extents include pixel widths/height at the edge.
-inputRasterTransforms = [] #for use in transforming world space coords to image space coords
+    with Instrumentation.Stage("loadFDR", file = inputRasterPath, useFDRCache = useFDRCache) as record:
+        if useFDRCache:
+            fdr = LoadPaddedFDR(inputRasterPath, raster.GetRasterBand(1).GetNoDataValue(), fdrCachePath)
+        else:
+            with Instrumentation.Stage("readFDR", file = inputRasterPath):
+                fdr = raster.ReadAsArray()
+            with Instrumentation.Stage("padFDR", cells = fdr.size):
+                fdr = numpy.pad(fdr, 1, "constant", constant_values = raster.GetRasterBand(1).GetNoDataValue())
+        record["cells"] = fdr.size
+
+    return raster, fdr
+
+#Returns minX, minY, maxX, maxY. Note: extents include pixel widths/height at the edge.
+def ComputeExtent(transforms : list, sizeX : int, sizeY : int) -> list:
+    x0 = transforms[0] - transforms[1] / 2.0
+    y0 = transforms[3] + abs(transforms[5] / 2.0)
+    x1 = x0 + sizeX * transforms[1] + transforms[1]
+    y1 = y0 - abs(sizeY * transforms[5]) - abs(transforms[5])
+
+    return [min(x0, x1),
+            min(y0, y1),
+            max(x0, x1),
+            max(y0, y1)]
+
+def IsWithinBounds(geoPoint : list, extents : list) -> bool:
+    return extents[0] <= geoPoint[0] <= extents[2] and extents[1] <= geoPoint[1] <= extents[3]
+
+#Returns the coordinates of geoCoordPair in the padded image space, None if it's outside extents or falls in the padding (extents
+#include half a pixel of slack on each side, see ComputeExtent()).
+#transforms is the raster's geotransform: anchor coord x and y = 0 and 3, pixelSizeX = 1, pixelSizeY = 5. sizeX and sizeY are the
+#raster's (unpadded) width and height.
+def GeoCoordToImageSpace(geoCoordPair : list, transforms : list, extents : list, sizeX : int, sizeY : int) -> list:
+    if not IsWithinBounds(geoCoordPair, extents):
+        return None
 
-#defs 
-def LoadInputRaster():
-    global raster
-    global fdr
-    global inputRasterExtents
-    global inputRasterTransforms 
+    outlet = [  math.floor(-1 * (transforms[3] - geoCoordPair[1]) / transforms[5]) + 1,
+                math.floor((geoCoordPair[0] - transforms[0]) / transforms[1]) + 1]
 
-    raster = gdal.Open(inputRasterPath, gdal.GA_ReadOnly)
-
-    fdr = raster.ReadAsArray()
-    #pad the input raster's data array with NoData to avoid adding boundary check for the edges. Note that now coordinates are shifted by (1,1)
-    fdr = numpy.pad(fdr, 1, "constant", constant_values = raster.GetRasterBand(1).GetNoDataValue())
-    
-    #cache some parameters used continusly bellow
-    inputRasterTransforms = raster.GetGeoTransform() #anchor coord x and y = 0 and 3, pixelSizeX = 1, pixelSizeY = 5
-    
-    x0 = inputRasterTransforms[0] - inputRasterTransforms[1] / 2.0
-    y0 = inputRasterTransforms[3] + abs(inputRasterTransforms[5] / 2.0)
-    x1 = x0 + raster.RasterXSize * inputRasterTransforms[1] + inputRasterTransforms[1]
-    y1 = y0 - abs(raster.RasterYSize * inputRasterTransforms[5]) - abs(inputRasterTransforms[5])
-
-    inputRasterExtents = [min(x0, x1),
-                          min(y0, y1),
-                          max(x0, x1),
-                          max(y0, y1)]
-
-    print (f"Loaded input raster extent: {inputRasterExtents}")
-
-def IsWithinBounds(geoPoint : list) -> bool:
-    return inputRasterExtents[0] <= geoPoint[0] <= inputRasterExtents[2] and inputRasterExtents[1] <= geoPoint[1] <= inputRasterExtents[3]
-
-def GeoCoordToImageSpace(geoCoordPair : list) -> list:
-    if not IsWithinBounds(geoCoordPair):
+    if not (1 <= outlet[0] <= sizeY and 1 <= outlet[1] <= sizeX):
         return None
-    
-    outlet = [  int(-1 * (inputRasterTransforms[3] - geoCoordPair[1]) / inputRasterTransforms[5]) + 1,
-                int((geoCoordPair[0] - inputRasterTransforms[0]) / inputRasterTransforms[1]) + 1]
-    
+
     return outlet
 
-def LoadOutletsAsImageSpacePoints() -> list:
+def LoadOutletsAsImageSpacePoints(inputOutletsPath : str, transforms : list, extents : list, sizeX : int, sizeY : int) -> list:
     geoPoints = ogr.Open(inputOutletsPath, 0)
     featureCount = geoPoints.GetLayer().GetFeatureCount()
     print (f"Loading an outlets file with {featureCount} features")
     points = []
-    
+
     for feature in geoPoints.GetLayer():
         geom = feature.geometry()
         geoCoords = [geom.GetX(), geom.GetY()]
-        imageCoords = GeoCoordToImageSpace(geoCoords)
+        imageCoords = GeoCoordToImageSpace(geoCoords, transforms, extents, sizeX, sizeY)
 
         if imageCoords is None:
             print (f"Warning! Coordinates {geoCoords} are outside the input raster's extents")
@@ -86,95 +93,237 @@ def LoadOutletsAsImageSpacePoints() -> list:
 
     return points
 
-# #test
-# LoadInputRaster()
-# print (LoadOutletsAsImageSpacePoints())
+#Paths are stored as flat (row * width + column) indices rather than [row, column] pairs: as int32 numpy arrays these take 4 bytes
+#per cell, against 100+ bytes for Python lists of two-element lists. int64 is used instead only for grids too large for int32.
+def FlatIndexType(cellsCount : int):
+    return numpy.int32 if cellsCount <= numpy.iinfo(numpy.int32).max else numpy.int64
 
-# exit()
-# #end test
-
-def UpstreamNeighbours(pixel : list) -> list: #return a list of cells that pour to this point
-    #get a view around the pixel
-    rawNeighbours = fdr[pixel[0] - 1 : pixel[0] + 2, pixel[1] - 1 : pixel[1] + 2]
-    #print (f"find neighbours for pixel {pixel}") #test
-    #loop and check each neighbour if its pouring towards the centre, using usNeighboursFDR as a reference.
-    usNeighbours = []
+#Pairs of (offset of the neighbour's flat index, value it must have to pour to the central cell), for a padded FDR of the given width.
+#usNeighboursFDR is one of usNeighboursFDRConventions' values.
+def FlatNeighbours(usNeighboursFDR, width : int) -> list:
+    neighbours = []
     for row in range(0, 3):
         for column in range (0, 3):
             if row == column == 1: #central cell, skip
                 continue
-            #print (f"neighbour {row},{column}, fdr = {rawNeighbours[row, column]}, us ref: {usNeighboursFDR[row, column]}") #test
-            # if  pixel == [364, 22]: #test
-            #     print (f"neighbour {row},{column}, fdr = {rawNeighbours[row, column]}, us ref: {usNeighboursFDR[row, column]}") #test
-            if rawNeighbours[row, column] == usNeighboursFDR[row, column]:
-                usNeighbours.append([pixel[0] + row - 1, pixel[1] + column - 1])
+            neighbours.append(((row - 1) * width + column - 1, usNeighboursFDR[row, column]))
 
-    return usNeighbours
+    return neighbours
 
-# print (UpstreamNeighbours(outlet)) #test
-# exit() #test
+#flatFDR is the padded FDR array flattened, pixel a flat index in it, neighbours as returned by FlatNeighbours().
+def UpstreamNeighbours(pixel : int, flatFDR, neighbours : list) -> list: #return a list of cells that pour to this point
+    #check each neighbour if its pouring towards the centre, using usNeighboursFDR as a reference.
+    return [pixel + offset for offset, usValue in neighbours if flatFDR[pixel + offset] == usValue]
 
 #recursive function
 #caveats of this approach (other than obvious overflow risk and performance) is that it gives cardinal and ordinal neighbours same weight.
-def TraceLFP(outlet : list) -> list:
+#Returns the path as a list of flat indices, from the source to the outlet.
+def TraceFlatLFP(outlet : int, flatFDR, neighbours : list) -> list:
     #get surrounding pixels
-    usNeighbours = UpstreamNeighbours(outlet)
-    
+    usNeighbours = UpstreamNeighbours(outlet, flatFDR, neighbours)
+
     if len(usNeighbours) == 0: #this is the heighest point. Ideally at the water divide.
         return [outlet]
-    
-    longestPath = TraceLFP(usNeighbours[0])
+
+    longestPath = TraceFlatLFP(usNeighbours[0], flatFDR, neighbours)
 
     for i in range (1, len(usNeighbours)):
-        longestPath2 = TraceLFP(usNeighbours[i])
+        longestPath2 = TraceFlatLFP(usNeighbours[i], flatFDR, neighbours)
         if (len(longestPath2) > len (longestPath)):
             longestPath = longestPath2
-    
+
     longestPath.append(outlet)
     return longestPath
 
-def CreateOutputRasterAndArray(inputRaster, outputNoDataValue = 0):
-    outputPath = baseOutputPath = os.path.dirname(inputRasterPath) + "/lfp.tif" 
-    counter = 1
-    while os.path.exists(outputPath):
-        outputPath = baseOutputPath[:-4] + str(counter) + ".tif"
-        counter += 1
-
-    sourceX = inputRaster.RasterXSize
-    sourceY = inputRaster.RasterYSize
+#Trace the LFP of outlet ([row, column] in the padded fdr). Returns the path as an array of flat indices in the padded fdr, from the
+#source to the outlet.
+#Note: only the returned path is compact. While tracing, TraceFlatLFP() still builds it as Python lists (~36 bytes per cell, on top of
+#a stack frame per cell), so peak memory for very long paths is barely lower. For those, use BuildUpstreamGrids() and ExtractLFP()
+#(--lfp-cache) instead, which write the path straight into an int32 array.
+def TraceLFP(outlet : list, fdr, usNeighboursFDR):
+    width = fdr.shape[1]
+    path = TraceFlatLFP(outlet[0] * width + outlet[1], fdr.reshape(-1), FlatNeighbours(usNeighboursFDR, width))
+    return numpy.array(path, dtype = FlatIndexType(fdr.size))
+
+#Non recursive alternative to tracing each outlet, for the whole (padded) FDR at once. Returns two arrays shaped like fdr:
+#length, the number of cells of the longest path from a source down to each cell (itself included, 0 for cells on or downstream of
+#flow loops), and predecessor, the flat index of the upstream neighbour that path comes from (-1 for sources). The LFP of any outlet
+#is then extracted by ExtractLFP(), and is the same path TraceLFP() returns (ties go to the first neighbour, in FlatNeighbours()' order).
+#Cells are visited in topological order, all cells whose upstream cells are all done at once, so the number of numpy passes is the
+#length of the longest path in the FDR rather than the number of cells.
+def BuildUpstreamGrids(fdr, usNeighboursFDR):
+    width = fdr.shape[1]
+    indexType = FlatIndexType(fdr.size)
+    neighbours = FlatNeighbours(usNeighboursFDR, width)
+
+    #flat index of the cell each (unpadded) cell pours to, -1 if none. Padding never pours, same as in UpstreamNeighbours()
+    downstream = numpy.full(fdr.size, -1, dtype = indexType)
+    for offset, usValue in neighbours:
+        rows, columns = numpy.nonzero(fdr[1 : -1, 1 : -1] == usValue)
+        cells = (rows + 1) * width + columns + 1
+        downstream[cells] = cells - offset
+
+    pouring = downstream >= 0
+    upstreamCount = numpy.bincount(downstream[pouring], minlength = fdr.size).astype(numpy.uint8)
+
+    length = numpy.zeros(fdr.size, dtype = numpy.int32)
+    frontier = numpy.flatnonzero(upstreamCount == 0) #sources
+    level = 1
+    while frontier.size > 0:
+        length[frontier] = level
+        receivers, counts = numpy.unique(downstream[frontier[pouring[frontier]]], return_counts = True)
+        upstreamCount[receivers] -= counts.astype(numpy.uint8)
+        frontier = receivers[upstreamCount[receivers] == 0]
+        level += 1
+
+    #the predecessor is the upstream neighbour one cell shorter. Neighbours are checked in reverse order so the first one wins ties.
+    predecessor = numpy.full(fdr.size, -1, dtype = indexType)
+    for offset, usValue in reversed(neighbours):
+        rows, columns = numpy.nonzero(fdr[1 : -1, 1 : -1] == usValue)
+        cells = (rows + 1) * width + columns + 1
+        cells = cells[length[cells] == length[cells - offset] - 1]
+        predecessor[cells - offset] = cells
+
+    return length.reshape(fdr.shape), predecessor.reshape(fdr.shape)
+
+#Returns the LFP of outlet (flat index in the padded fdr) as TraceLFP() does, following the grids returned by BuildUpstreamGrids().
+#Raises a ValueError if outlet is on or downstream of a flow loop, since its LFP is then endless (TraceLFP() recurses until it
+#raises a RecursionError for these).
+def ExtractLFP(outlet : int, length, predecessor):
+    flatPredecessor = predecessor.reshape(-1)
+    outletLength = int(length.reshape(-1)[outlet])
+    if outletLength == 0:
+        raise ValueError(f"Outlet at flat index {outlet} (padded image space) is on or downstream of a flow loop in the FDR, it has no LFP")
+    path = numpy.empty(outletLength, dtype = predecessor.dtype)
+
+    pixel = outlet
+    for i in range(len(path) - 1, -1, -1): #from the outlet up to the source
+        path[i] = pixel
+        pixel = flatPredecessor[pixel]
+
+    return path
+
+#Convert flat indices in a padded array of paddedWidth to flat indices in the unpadded one.
+def UnpadFlatIndices(flatIndices, paddedWidth : int):
+    rows, columns = numpy.divmod(flatIndices, paddedWidth)
+    return (rows - 1) * (paddedWidth - 2) + (columns - 1)
+
+#Trace the LFP of each outlet (padded image space). Returns the flat indices (unpadded image space) and values (outlet's order starting
+#from 1) of all the paths' cells, in tracing order, as numpy arrays.
+#If upstreamGrids (as returned by BuildUpstreamGrids()) is given, the paths are extracted from them instead, and fdr isn't used.
+def TraceLFPCells(points : list, fdr, usNeighboursFDR, upstreamGrids = None):
+    paddedShape = fdr.shape if upstreamGrids is None else upstreamGrids[0].shape
+    indexType = FlatIndexType(paddedShape[0] * paddedShape[1])
+    flatIndices = [numpy.zeros(0, dtype = indexType)]
+    values = [numpy.zeros(0, dtype = numpy.int16)]
 
-    outputRaster = gdal.GetDriverByName("GTiff").Create(outputPath, xsize = sourceX, ysize = sourceY, bands = 1, eType = gdal.GDT_Int16)
+    counter = 1
+    for point in points:
+        with Instrumentation.Stage("traceLFP", outlet = counter, pixel = point) as record:
+            if upstreamGrids is None:
+                lfp = TraceLFP(point, fdr, usNeighboursFDR)
+            else:
+                lfp = ExtractLFP(point[0] * paddedShape[1] + point[1], *upstreamGrids)
+            record["cells"] = len(lfp)
 
-    outputRaster.SetProjection(inputRaster.GetProjection())
-    outputRaster.SetGeoTransform(inputRaster.GetGeoTransform())
-    outputRaster.GetRasterBand(1).SetNoDataValue(outputNoDataValue)
+        #remember to adjust indexing to the padding we did above
+        flatIndices.append(UnpadFlatIndices(lfp, paddedShape[1]))
+        values.append(numpy.full(len(lfp), counter, dtype = numpy.int16))
 
-    outputArray = numpy.full(shape=(sourceY, sourceX), fill_value = outputNoDataValue, dtype = numpy.int16, order="C")
+        counter += 1
 
-    print (f"Created output raster at {outputPath}")
-    return outputRaster, outputArray
+    return numpy.concatenate(flatIndices), numpy.concatenate(values)
 
+#Trace the LFP of each outlet (padded image space) and burn it into an unpadded array, with value = outlet's order starting from 1.
+def RasteriseLFPs(points : list, fdr, usNeighboursFDR, outputNoDataValue = 0):
+    lfpArray = numpy.full(shape=(fdr.shape[0] - 2, fdr.shape[1] - 2), fill_value = outputNoDataValue, dtype = numpy.int16, order="C")
 
-#Processing steps
-LoadInputRaster()
-points = LoadOutletsAsImageSpacePoints()
+    flatIndices, values = TraceLFPCells(points, fdr, usNeighboursFDR)
+    lfpArray.reshape(-1)[flatIndices] = values #where paths overlap, the later outlet's value is kept
 
-#exit() #test
-#create lfp raster based on the computed lfp
-output, lfpArray = CreateOutputRasterAndArray(raster) #TODO rewrite this function. Creating output raster should happen after the loop bellow (but we need array before)
+    return lfpArray
 
-counter = 1
-for point in points:
-    lfp = TraceLFP(point)
+#Returns a path for the output next to the input raster, that doesn't overwrite existing lfp rasters.
+def OutputPath(inputRasterPath : str) -> str:
+    outputPath = baseOutputPath = os.path.dirname(inputRasterPath) + "/lfp.tif"
+    counter = 1
+    while os.path.exists(outputPath):
+        outputPath = baseOutputPath[:-4] + str(counter) + ".tif"
+        counter += 1
 
-    for pixel in lfp:
-        #remember to adjust indexing to the padding we did above
-        lfpArray[pixel[0] - 1, pixel[1] - 1] = counter
-    
-    counter += 1
+    return outputPath
 
-#write to disk
-output.GetRasterBand(1).WriteArray(lfpArray)
-output = None
+#Write the LFP cells (as returned by TraceLFPCells()) to a new raster at outputPath, matching inputRaster, block by block (see
+#Output_Raster.py) so the full size output is never held in memory. creationOptions override the default GTiff creation options.
+def WriteLFPRaster(inputRaster, outputPath : str, flatIndices, values, outputNoDataValue = 0, creationOptions : dict = None):
+    outputRaster = Output_Raster.CreateOutputRaster(outputPath, inputRaster, gdal.GDT_Int16, outputNoDataValue, creationOptions)
+    print (f"Created output raster at {outputPath}")
 
-print ("Done!")
\ No newline at end of file
+    Output_Raster.BurnPixels(outputRaster.GetRasterBand(1), flatIndices, values, outputNoDataValue)
+    outputRaster = None #flush to disk
+
+#Returns the upstream grids of the FDR at inputRasterPath (see BuildUpstreamGrids()), loaded from their cache next to the FDR (see
+#LFP_Cache.py). If there is none for this FDR and encoding, they are built and cached first. fdr is the padded FDR if already loaded,
+#else it's only loaded (as in LoadInputRaster()) when the cache must be built.
+def LoadCachedUpstreamGrids(inputRasterPath : str, fdrEncoding : str, fdr = None, useFDRCache : bool = False, fdrCachePath : str = None):
+    cacheStem = os.path.splitext(inputRasterPath)[0]
+    key = UpstreamCacheKey(FDRChecksum(inputRasterPath), fdrEncoding)
+    if IsUpstreamCacheCurrent(cacheStem, key):
+        return LoadUpstreamGrids(cacheStem, key)
+
+    if fdr is None:
+        fdr = LoadInputRaster(inputRasterPath, useFDRCache, fdrCachePath)[1]
+    with Instrumentation.Stage("buildUpstreamGrids", cells = fdr.size):
+        length, predecessor = BuildUpstreamGrids(fdr, usNeighboursFDRConventions[fdrEncoding])
+
+    return WriteUpstreamGrids(length, predecessor, cacheStem, key)
+
+#Processing steps. Returns the path of the lfp raster written (defaults to lfp.tif next to the FDR).
+#If useLFPCache is True, the paths are extracted from the cached upstream grids of the FDR (see LoadCachedUpstreamGrids()) instead of
+#being traced, so rerunning with new outlets only costs the extraction.
+def ComputeLongestFlowPaths(inputRasterPath : str, inputOutletsPath : str, fdrEncoding : str = "TauDEM", outputPath : str = None,
+                            useFDRCache : bool = False, fdrCachePath : str = None, creationOptions : dict = None, useLFPCache : bool = False) -> str:
+    if useLFPCache:
+        raster, fdr = gdal.Open(inputRasterPath, gdal.GA_ReadOnly), None
+        upstreamGrids = LoadCachedUpstreamGrids(inputRasterPath, fdrEncoding, None, useFDRCache, fdrCachePath)
+    else:
+        raster, fdr = LoadInputRaster(inputRasterPath, useFDRCache, fdrCachePath)
+        upstreamGrids = None
+    transforms = raster.GetGeoTransform()
+    extents = ComputeExtent(transforms, raster.RasterXSize, raster.RasterYSize)
+    print (f"Loaded input raster extent: {extents}")
+
+    with Instrumentation.Stage("loadOutlets", file = inputOutletsPath) as record:
+        points = LoadOutletsAsImageSpacePoints(inputOutletsPath, transforms, extents, raster.RasterXSize, raster.RasterYSize)
+        record["outlets"] = len(points)
+
+    flatIndices, values = TraceLFPCells(points, fdr, usNeighboursFDRConventions[fdrEncoding], upstreamGrids)
+
+    #write to disk
+    outputPath = OutputPath(inputRasterPath) if outputPath is None else outputPath
+    with Instrumentation.Stage("write", file = outputPath, cells = len(flatIndices)):
+        WriteLFPRaster(raster, outputPath, flatIndices, values, creationOptions = creationOptions)
+
+    return outputPath
+
+def Main():
+    parser = argparse.ArgumentParser(description = "Compute the longest flow path of each outlet from a flow direction raster")
+    parser.add_argument("inputRasterPath", help = "FDR raster")
+    parser.add_argument("inputOutletsPath", help = "outlets OGR file")
+    parser.add_argument("--encoding", dest = "fdrEncoding", choices = list(usNeighboursFDRConventions.keys()), default = "TauDEM", help = "flow direction convention of the FDR")
+    parser.add_argument("--output", dest = "outputPath", default = None, help = "output path, defaults to lfp.tif next to the FDR")
+    parser.add_argument("--fdr-cache", dest = "useFDRCache", action = "store_true", help = "cache the padded FDR as a memory-mapped .npy file (see FDR_Cache.py)")
+    parser.add_argument("--fdr-cache-path", dest = "fdrCachePath", default = None, help = "where to store the FDR cache, defaults to next to the FDR")
+    parser.add_argument("--lfp-cache", dest = "useLFPCache", action = "store_true",
+                        help = "build (or reuse) the FDR's upstream length and predecessor grids next to it, and extract the paths from them (see LFP_Cache.py)")
+    Output_Raster.AddArguments(parser)
+    Instrumentation.AddArguments(parser)
+    args = parser.parse_args()
+
+    with Instrumentation.FromArguments(args, "Continuous_Longest_Flow_Path"):
+        ComputeLongestFlowPaths(args.inputRasterPath, args.inputOutletsPath, args.fdrEncoding, args.outputPath, args.useFDRCache, args.fdrCachePath,
+                                Output_Raster.CreationOptionsFromArguments(args), args.useLFPCache)
+    print ("Done!")
+
+if __name__ == "__main__":
+    Main()
@@ -2,105 +2,210 @@
 #For references on CI, see
     #https://doi.org/10.5194/hess-14-1527-2010
     #https://doi.org/10.1016/j.geomorph.2020.107123
-
-from osgeo import gdal
-import numpy, math, os, sys
-
-#Input path to the aspect image
-inputPath = "/path/to/aspec/raster.tif"
-
-#the window size of the CI computations. Program will take a square of width = 2 * window + 1
-window = 1   
-
-if not os.path.exists(inputPath):
-    print(f"file \"{inputPath}\" does not exist")
-    sys.exit() #stops the execution of this code.
-
-#create output file path based on input
-outputPath = inputPath[0:-4] + "_ConvergenceIndex.tif" 
-
-#open the source aspect image
-raster = gdal.Open(inputPath, gdal.GA_ReadOnly)
-
-#get some details we need for output creation and computations
-sourceX = raster.RasterXSize
-sourceY = raster.RasterYSize
-sourceBands = raster.RasterCount
-sourceType = raster.GetRasterBand(1).DataType
-sourceNoDataVal = raster.GetRasterBand(1).GetNoDataValue()
-sourceProjection = raster.GetProjection()
-sourceGeoTransform = raster.GetGeoTransform()
-
-#"aspect" here is going to be a numpy array with the raster's values.
-aspect = raster.ReadAsArray()
-
-print (f"rows x column: {sourceY} x {sourceX}, bands: {sourceBands}, noData: {sourceNoDataVal}")
-
-#create an output file, set its parameter to match the input
-output = gdal.GetDriverByName("GTiff").Create(outputPath, xsize = sourceX, ysize = sourceY, bands = sourceBands, eType = sourceType)
-
-output.SetProjection(sourceProjection)
-output.SetGeoTransform(sourceGeoTransform)
-output.GetRasterBand(1).SetNoDataValue(sourceNoDataVal)
-
-#create a memory array to store our computations, will have a default NoData value.
-dataset = numpy.full(shape=(sourceY, sourceX), fill_value= sourceNoDataVal, dtype = numpy.float32, order="C")
-
-#Create an array to store the direction from each grid  cell to the center as an azimuth angle
-centerDir = numpy.zeros((2 * window + 1, 2 * window + 1), dtype = numpy.float32)
-#compute the direction-to-center array. Basic mathematics/trigonometry. 
-for row in range (0, window * 2 + 1):
-    for column in range (0, window * 2 + 1):
-        distY = row - window
-        distX = window - column
-        toCenterAzimuth = math.degrees(math.atan2(distX, distY)) #atan2(opposite, adjacent), returns radians, so convert to degrees
-        
-        #we need the azimuth (angle from the north), the atan2() returns negatives for angles in 2nd and 3rd quadrants, we fix that first
-        if (toCenterAzimuth < 0):
-            toCenterAzimuth += 360
-        centerDir[row, column] = toCenterAzimuth
-
-print (centerDir)
-
-#Now we compute the convergence index
-for row in range(window, sourceY - window):
-    for column in range (window, sourceX - window):
-        if aspect[row, column] != sourceNoDataVal:
-            #Get a slice (a "view") of the original aspect array covering only the window we are working inside
-            subArray = aspect[row - window : row + window + 1, column - window : column + window + 1]
-            
-            #counter is the number of samples we are going to average.
-            #To account for cells with possible NoData, we first need to count valid cells (minus central ones)
-            # (subArrau != sourceNoDataValue) returns a boolean array with 1 for cells with data, and 0 for NoData. count_nonzero counts the former.
-            counter = numpy.count_nonzero(subArray != sourceNoDataVal) - 1
-
-            #We create a copy of the view in which we replace the NoData values with zero. Because typical values like -9999 would break the
-            #summing component of the averaging process.
-            sanitizedSubArray = subArray
-            sanitizedSubArray[sanitizedSubArray == sourceNoDataVal] = 0.0 # This part basically tells Numpy to replace cells with values = NoData with 0.
-
-            #Returning the delta between angles is a little bit tricker than just subtracting them (because of their cyclical nature)
-            #delta_t = 180 - ||t1 - t2| - 180|
-            absDiff = 180.0 - numpy.abs(numpy.abs(sanitizedSubArray - centerDir)  - 180.0)
-
-            ci = absDiff.sum()
-            
-            #Old, "naive" implementation. Could be useful for demoing how things work without numpy abstraction (minus its optimisations)
-            #ci = 0.0
-            #counter = 0
-            # for subRow in range (0, 2 * window + 1):
-            #     for subColumn in range (0, 2 * window + 1):
-            #         #Skip central cell and cells with noData
-            #         if (subRow == window and subColumn == window) or (subArray[subRow, subColumn] == sourceNoDataVal):
-            #             continue
-            #         ci += 180.0 - abs(abs(subArray[subRow, subColumn] - centerDir[subRow, subColumn]) - 180.0)
-            #         counter += 1
-
-            #Some cells may have all NoData neighbours (e.g. cells near the edge), we disregard those (since they are already set as NoData. See "dataset" definition above)
-            if counter > 0:
-                dataset[row, column] = (ci / counter) - 90.0
-
-output.GetRasterBand(1).WriteArray(dataset) #write the computations above to the output raster (good place to remind of the difference between memory and file)
-output = None #to flush to disk, GDAL python api requies closing the file (e.g. by dereferencing) (also good place to explain about memory flushing)
-
-print ("Done!")
\ No newline at end of file
+#Can be imported (ConvergenceIndex() works on numpy arrays, ComputeConvergenceIndex() on files) or run from the command line:
+#   python Convergence_Index.py /path/to/aspect/raster.tif --window 1 [--output-type Int16 --scale 100]
+
+from osgeo import gdal, gdal_array
+import numpy, math, os, sys, argparse
+import Instrumentation
+import Output_Raster
+
+#Create an array storing the direction from each grid cell of the window to its center as an azimuth angle.
+#window is the half width of the CI computations window. Windows are squares of width = 2 * window + 1
+def ComputeCenterDirections(window : int):
+    centerDir = numpy.zeros((2 * window + 1, 2 * window + 1), dtype = numpy.float32)
+    #compute the direction-to-center array. Basic mathematics/trigonometry.
+    for row in range (0, window * 2 + 1):
+        for column in range (0, window * 2 + 1):
+            distY = row - window
+            distX = window - column
+            toCenterAzimuth = math.degrees(math.atan2(distX, distY)) #atan2(opposite, adjacent), returns radians, so convert to degrees
+
+            #we need the azimuth (angle from the north), the atan2() returns negatives for angles in 2nd and 3rd quadrants, we fix that first
+            if (toCenterAzimuth < 0):
+                toCenterAzimuth += 360
+            centerDir[row, column] = toCenterAzimuth
+
+    return centerDir
+
+#Returns a boolean array, True for the cells of array that aren't noDataValue. NaN never compares equal to itself, so a NaN NoData
+#(common for float aspect rasters) is matched with isnan() instead.
+def HasData(array, noDataValue):
+    if numpy.isnan(noDataValue):
+        return ~numpy.isnan(array)
+    return array != noDataValue
+
+#Compute the CI of an aspect array. Returns a float32 array of the same shape, with noDataValue for cells that are NoData in the
+#aspect, within window of the edges, or have no valid neighbours. aspect is not modified.
+def ConvergenceIndex(aspect, noDataValue, window : int = 1):
+    sourceY, sourceX = aspect.shape
+
+    #create a memory array to store our computations, will have a default NoData value.
+    dataset = numpy.full(shape=(sourceY, sourceX), fill_value= noDataValue, dtype = numpy.float32, order="C")
+
+    centerDir = ComputeCenterDirections(window)
+    aspectHasData = HasData(aspect, noDataValue)
+
+    #Now we compute the convergence index
+    for row in range(window, sourceY - window):
+        for column in range (window, sourceX - window):
+            if aspectHasData[row, column]:
+                #Get a slice (a "view") of the original aspect array covering only the window we are working inside
+                subArray = aspect[row - window : row + window + 1, column - window : column + window + 1]
+
+                #counter is the number of samples we are going to average.
+                #To account for cells with possible NoData, we first need to count valid cells (minus central ones)
+                # (see HasData()) this is a boolean array with 1 for cells with data, and 0 for NoData. count_nonzero counts the former.
+                hasData = aspectHasData[row - window : row + window + 1, column - window : column + window + 1]
+                counter = numpy.count_nonzero(hasData) - 1
+
+                #We create a copy of the view in which we replace the NoData values with zero. Because typical values like -9999 would break the
+                #summing component of the averaging process. (a copy, not the view itself, else we'd overwrite NoData in the aspect array)
+                sanitizedSubArray = numpy.where(hasData, subArray, 0.0)
+
+                #Returning the delta between angles is a little bit tricker than just subtracting them (because of their cyclical nature)
+                #delta_t = 180 - ||t1 - t2| - 180|
+                absDiff = 180.0 - numpy.abs(numpy.abs(sanitizedSubArray - centerDir)  - 180.0)
+
+                ci = absDiff.sum()
+
+                #Old, "naive" implementation. Could be useful for demoing how things work without numpy abstraction (minus its optimisations)
+                #ci = 0.0
+                #counter = 0
+                # for subRow in range (0, 2 * window + 1):
+                #     for subColumn in range (0, 2 * window + 1):
+                #         #Skip central cell and cells with noData
+                #         if (subRow == window and subColumn == window) or (subArray[subRow, subColumn] == noDataValue):
+                #             continue
+                #         ci += 180.0 - abs(abs(subArray[subRow, subColumn] - centerDir[subRow, subColumn]) - 180.0)
+                #         counter += 1
+
+                #Some cells may have all NoData neighbours (e.g. cells near the edge), we disregard those (since they are already set as NoData. See "dataset" definition above)
+                if counter > 0:
+                    dataset[row, column] = (ci / counter) - 90.0
+
+    return dataset
+
+#Convert a CI array (as returned by ConvergenceIndex()) to the numpy type matching outputType (a gdal.GDT_* constant), multiplying the
+#values by scale. For integer types values are rounded to the nearest integer, e.g. Int16 with scale = 100 keeps 2 decimal digits
+#(CI is within [-90, 90], so within Int16's range) at half the size of Float32. NoData cells become outputNoDataValue.
+def ConvertToType(dataset, noDataValue, outputType, scale : float, outputNoDataValue):
+    dtype = gdal_array.GDALTypeCodeToNumericTypeCode(outputType)
+    hasData = HasData(dataset, noDataValue)
+
+    output = numpy.full(dataset.shape, outputNoDataValue, dtype = dtype)
+    if numpy.issubdtype(dtype, numpy.integer):
+        output[hasData] = numpy.rint(dataset[hasData] * scale)
+    else:
+        output[hasData] = dataset[hasData] * scale
+
+    return output
+
+#CI is within [-90, 90]. For integer outputType (a gdal.GDT_* constant), raise a ValueError if, multiplied by scale, it doesn't fit in
+#the type or its range includes outputNoDataValue, rather than let values wrap around when converted (see ConvertToType()). Also raises
+#it if outputNoDataValue is NaN, which integer types can't hold.
+def CheckScaledRange(outputType, scale : float, outputNoDataValue):
+    dtype = gdal_array.GDALTypeCodeToNumericTypeCode(outputType)
+    if not numpy.issubdtype(dtype, numpy.integer): #floats can't wrap around
+        return
+
+    if numpy.isnan(outputNoDataValue):
+        raise ValueError(f"NoData value {outputNoDataValue} can't be stored in {numpy.dtype(dtype).name}, use --output-nodata to set one")
+
+    typeInfo = numpy.iinfo(dtype)
+    maxValue = numpy.rint(90.0 * abs(scale))
+    if maxValue > typeInfo.max or -maxValue < typeInfo.min:
+        raise ValueError(f"CI scaled by {scale} spans [{-maxValue:g}, {maxValue:g}], which doesn't fit in {numpy.dtype(dtype).name} "
+                         f"[{typeInfo.min}, {typeInfo.max}]. Use a smaller scale or a larger type")
+    if -maxValue <= outputNoDataValue <= maxValue:
+        raise ValueError(f"NoData value {outputNoDataValue} is within the range of CI scaled by {scale}, [{-maxValue:g}, {maxValue:g}]")
+
+#Compute the CI of the aspect raster at inputPath and write it to outputPath (defaults to next to the input). Returns outputPath.
+#The raster is processed in strips of whole output blocks (each read with window extra rows on both sides), so neither the aspect
+#nor the CI is ever held in memory in full.
+#creationOptions override the output's default GTiff creation options (see Output_Raster.py).
+#The output is written as outputType (a gdal.GDT_* constant, Float32 by default, regardless of the aspect's type, since CI is
+#fractional), with values multiplied by scale (see ConvertToType()). The band's scale metadata is set to 1 / scale, so GDAL aware
+#readers get the CI back in degrees. outputNoDataValue defaults to the aspect's NoData for float types, and the type's minimum for
+#integer types. Raises a ValueError if scale doesn't fit outputType (see CheckScaledRange()).
+def ComputeConvergenceIndex(inputPath : str, outputPath : str = None, window : int = 1, creationOptions : dict = None,
+                            outputType = gdal.GDT_Float32, scale : float = 1.0, outputNoDataValue = None) -> str:
+    #create output file path based on input
+    if outputPath is None:
+        outputPath = inputPath[0:-4] + "_ConvergenceIndex.tif"
+
+    #open the source aspect image
+    raster = gdal.Open(inputPath, gdal.GA_ReadOnly)
+
+    #get some details we need for output creation and computations
+    sourceX = raster.RasterXSize
+    sourceY = raster.RasterYSize
+    sourceBands = raster.RasterCount
+    sourceNoDataVal = raster.GetRasterBand(1).GetNoDataValue()
+    if sourceNoDataVal is None: #aspect has no NoData, use a value it can't have
+        sourceNoDataVal = -9999.0
+
+    print (f"rows x column: {sourceY} x {sourceX}, bands: {sourceBands}, noData: {sourceNoDataVal}")
+
+    if outputNoDataValue is None:
+        outputDType = gdal_array.GDALTypeCodeToNumericTypeCode(outputType)
+        outputNoDataValue = numpy.iinfo(outputDType).min if numpy.issubdtype(outputDType, numpy.integer) else sourceNoDataVal
+    CheckScaledRange(outputType, scale, outputNoDataValue)
+
+    #create an output file, set its parameter to match the input
+    output = Output_Raster.CreateOutputRaster(outputPath, raster, outputType, outputNoDataValue, creationOptions)
+    inputBand = raster.GetRasterBand(1)
+    outputBand = output.GetRasterBand(1)
+    if scale != 1.0:
+        outputBand.SetScale(1.0 / scale)
+        outputBand.SetOffset(0.0)
+
+    stripHeight = Output_Raster.StripHeight(outputBand)
+    for rowStart in range(0, sourceY, stripHeight):
+        rowEnd = min(rowStart + stripHeight, sourceY)
+        #the rows above and below the strip are needed for the windows of its first and last rows. At the raster's edges there are
+        #none, and ConvergenceIndex() leaves these rows as NoData, same as it would for the whole raster.
+        haloStart = max(0, rowStart - window)
+        haloEnd = min(sourceY, rowEnd + window)
+
+        #"aspect" here is going to be a numpy array with the strip's values.
+        with Instrumentation.Stage("read", file = inputPath, row = rowStart) as record:
+            aspect = inputBand.ReadAsArray(0, haloStart, sourceX, haloEnd - haloStart)
+            record["cells"] = aspect.size
+
+        with Instrumentation.Stage("convergenceIndex", window = window, row = rowStart) as record:
+            dataset = ConvergenceIndex(aspect, sourceNoDataVal, window)
+            dataset = ConvertToType(dataset[rowStart - haloStart : rowEnd - haloStart], sourceNoDataVal, outputType, scale, outputNoDataValue)
+            record["cells"] = (rowEnd - rowStart) * sourceX
+
+        with Instrumentation.Stage("write", file = outputPath, row = rowStart, cells = (rowEnd - rowStart) * sourceX):
+            outputBand.WriteArray(dataset, 0, rowStart) #write the computations above to the output raster (good place to remind of the difference between memory and file)
+
+    with Instrumentation.Stage("flush", file = outputPath):
+        output = None #to flush to disk, GDAL python api requies closing the file (e.g. by dereferencing) (also good place to explain about memory flushing)
+
+    return outputPath
+
+def Main():
+    parser = argparse.ArgumentParser(description = "Compute the convergence index (CI) from an aspect raster")
+    parser.add_argument("inputPath", help = "path to the aspect raster")
+    parser.add_argument("--output", dest = "outputPath", default = None, help = "output path, defaults to <input>_ConvergenceIndex.tif")
+    parser.add_argument("--window", type = int, default = 1, help = "the window size of the CI computations, windows are squares of width = 2 * window + 1")
+    parser.add_argument("--output-type", dest = "outputType", choices = ["Float32", "Float64", "Int16", "Int32"], default = "Float32", help = "data type of the output")
+    parser.add_argument("--scale", type = float, default = 1.0, help = "multiply CI by this before writing, e.g. 100 with --output-type Int16")
+    parser.add_argument("--output-nodata", dest = "outputNoDataValue", type = float, default = None, help = "NoData value of the output")
+    Output_Raster.AddArguments(parser)
+    Instrumentation.AddArguments(parser)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.inputPath):
+        print(f"file \"{args.inputPath}\" does not exist")
+        sys.exit(1)
+
+    with Instrumentation.FromArguments(args, "Convergence_Index"):
+        ComputeConvergenceIndex(args.inputPath, args.outputPath, args.window, Output_Raster.CreationOptionsFromArguments(args),
+                                gdal.GetDataTypeByName(args.outputType), args.scale, args.outputNoDataValue)
+    print ("Done!")
+
+if __name__ == "__main__":
+    Main()
@@ -1,91 +1,124 @@
-#This script computes the longest flow path given a flow direction map (currently in TauDEM format), outlet points ogr file, and
+#This script computes the longest flow path given a flow direction map (TauDEM or GRASS format), outlet points ogr file, and
 #polygon ogr file for the subcatchments
-
+#Can be imported (ProcessLFPs() works on the clipped rasters, ComputeDiscreteLongestFlowPaths() on the input files) or run from the
+#command line:
+#   python Discrete_Longest_Flow_Path.py /path/to/fdr.tif /path/to/outlets.gpkg /path/to/subcatchments.gpkg --encoding TauDEM [--lfp-cache]
+#The tracing itself is shared with Continuous_Longest_Flow_Path.py.
 
 from osgeo import gdal, ogr
-import numpy, sys, os
-
-sys.setrecursionlimit(50000) #TODO this is a stupid hack to workaround the naivete of the recurssion implementation
-#Most likely will cause a stack overflow somewhere. Try bumping the limit up for large watersheds (or downsample them)
-#TODO implement file existence checks and handling I/O exceptions
-
-#Inputs
-inputRasterPath = "/path/here"
-inputOutletsPath = "/path/here"
-inputSubcatchmentsPath = "/path/here"
-
-tempDir = os.path.dirname(__file__) + "/tempDir/" #to store clipped rasters. Should be deleted after script finishes executing
-#TODO implement exception handling that calls cleanup method in case of some issue. Otherwise this directory (and any clipped\\
-#rasters) will remain on disk and cause this script to break in subsequent run.
-
-usNeighboursFDR = numpy.array([[8, 7, 6], [1, 0, 5], [2, 3, 4]]) #Value a pixel must have to be considered pouring to the central cell. From left to right, top to bottom.
-#TauDEM flow direction convention for FDR: 1 -East, 2 - Northeast, 3 - North, 4 - Northwest, 5 - West, 6 - Southwest, 7 - South, 8 - Southeast.
-#TODO add GRASS, ArcHydro/GIS/map, etc's conventions, plus means to pick which one to use.
+import numpy, math, os, shutil, tempfile, argparse
+from FDR_Cache import LoadPaddedFDR
+from LFP_Cache import FDRChecksum, UpstreamCacheKey, IsUpstreamCacheCurrent, LoadUpstreamGrids, LoadUpstreamWindow, WriteUpstreamGrids
+from Continuous_Longest_Flow_Path import usNeighboursFDRConventions, TraceLFP, BuildUpstreamGrids, ExtractLFP, FlatIndexType, UnpadFlatIndices, OutputPath, WriteLFPRaster
+import Instrumentation, Output_Raster
 
 outputNoDataValue = 0
 
-#cached parameters
-sourceY = 0
-sourceX = 0
-
-clippedRastersRefs = [] #holds a tuple containing file path for each clipped raster, and the geometry used to clip it (as WKT)
-outlets = [] #list of outlet georeferenced coordinates
-outputRaster = None #ref to gdal raster for output
-
-#defs 
-def ComputeExtent(rasterPath) -> list:
-    raster = gdal.Open(rasterPath, gdal.GA_ReadOnly)
-    transforms = raster.GetGeoTransform() #anchor coord x and y = 0 and 3, pixelSizeX = 1, pixelSizeY = 5
-    
-    x0 = transforms[0] - transforms[1] / 2.0
-    y0 = transforms[3] + abs(transforms[5] / 2.0)
-    x1 = x0 + raster.RasterXSize * transforms[1] + transforms[1]
-    y1 = y0 - abs(raster.RasterYSize * transforms[5]) - abs(transforms[5])
-
-    extent = [  min(x0, x1),
-                min(y0, y1),
-                max(x0, x1),
-                max(y0, y1)]
-    
-    return extent
-
-def ProcessInputRaster():
+#defs
+#Returns the window of the raster covering the envelope of the polygon polyAsWKT, as [rowOffset, columnOffset, rows, columns] in its
+#(unpadded) image space, clamped to the raster. transforms is the raster's geotransform (north up).
+def SubcatchmentWindow(polyAsWKT : str, transforms : list, sizeX : int, sizeY : int) -> list:
+    minX, maxX, minY, maxY = ogr.CreateGeometryFromWkt(polyAsWKT).GetEnvelope()
+    columnStart = max(0, math.floor((minX - transforms[0]) / transforms[1]))
+    columnEnd = min(sizeX, math.ceil((maxX - transforms[0]) / transforms[1]))
+    rowStart = max(0, math.floor((maxY - transforms[3]) / transforms[5]))
+    rowEnd = min(sizeY, math.ceil((minY - transforms[3]) / transforms[5]))
+
+    return [rowStart, columnStart, max(0, rowEnd - rowStart), max(0, columnEnd - columnStart)]
+
+#Convert flat indices in a window (as returned by SubcatchmentWindow()) to flat indices in the raster of width sizeX and sizeY rows.
+def WindowToRasterFlatIndices(flatIndices, window : list, sizeX : int, sizeY : int):
+    rows, columns = numpy.divmod(flatIndices.astype(FlatIndexType(sizeX * sizeY)), window[3])
+    return (rows + window[0]) * sizeX + columns + window[1]
+
+#Returns a boolean array over window (see SubcatchmentWindow()) of the raster with geotransform transforms, True for the cells whose
+#centre is within the polygon polyAsWKT, same as the cutline applied by gdal.Warp() in ClipToSubcatchments().
+def SubcatchmentMask(polyAsWKT : str, transforms : list, window : list):
+    maskRaster = gdal.GetDriverByName("MEM").Create("", window[3], window[2], 1, gdal.GDT_Byte)
+    maskRaster.SetGeoTransform([transforms[0] + window[1] * transforms[1], transforms[1], transforms[2],
+                                transforms[3] + window[0] * transforms[5], transforms[4], transforms[5]])
+
+    polys = ogr.GetDriverByName("Memory").CreateDataSource("")
+    layer = polys.CreateLayer("subcatchment", geom_type = ogr.wkbPolygon)
+    feature = ogr.Feature(layer.GetLayerDefn())
+    feature.SetGeometry(ogr.CreateGeometryFromWkt(polyAsWKT))
+    layer.CreateFeature(feature)
+    gdal.RasterizeLayer(maskRaster, [1], layer, burn_values = [1])
+
+    return maskRaster.ReadAsArray().astype(bool)
+
+#Returns the window (see SubcatchmentWindow()) of paddedFDR (the padded input FDR, see FDR_Cache.py), padded, with the cells outside
+#mask (see SubcatchmentMask()) set to noDataValue. Equivalent to reading and padding the subcatchment's clip, without writing it.
+def MaskedWindowFDR(paddedFDR, window : list, mask, noDataValue):
+    fdr = numpy.full((window[2] + 2, window[3] + 2), noDataValue, dtype = paddedFDR.dtype)
+    windowFDR = paddedFDR[window[0] + 1 : window[0] + 1 + window[2], window[1] + 1 : window[1] + 1 + window[3]]
+    fdr[1 : -1, 1 : -1] = numpy.where(mask, windowFDR, noDataValue)
+    return fdr
+
+#Clip the input raster to each subcatchment, storing the clips in tempDir. Clips are cropped to the window covering the subcatchment
+#(see SubcatchmentWindow()), on the input raster's grid.
+#Returns a list holding, for each clipped raster, its file path, the geometry used to clip it (as WKT), and its window.
+#isCached, if given, is called with each subcatchment's WKT. Subcatchments it returns True for (i.e. whose LFP cache exists) aren't
+#clipped, and their file path is None. Same for subcatchments outside the raster, and for all of them if clip is False (only the
+#windows are then computed, e.g. when masking from the padded FDR cache instead, see MaskedWindowFDR()).
+def ClipToSubcatchments(inputRasterPath : str, inputSubcatchmentsPath : str, tempDir : str, isCached = None, clip : bool = True) -> list:
     raster = gdal.Open(inputRasterPath, gdal.GA_ReadOnly)
-    
-    global sourceX
-    global sourceY
-    #global sourceTransforms
-
-    sourceX = raster.RasterXSize
-    sourceY = raster.RasterYSize
+    transforms = raster.GetGeoTransform()
 
     polys = ogr.Open(inputSubcatchmentsPath, 0)
     polyCount = polys.GetLayer().GetFeatureCount()
     print (f"Clipping input raster to {polyCount} subcatchments")
-    
+
     crs = polys.GetLayer().GetSpatialRef()
-    
-    os.makedirs(tempDir)
 
+    clippedRastersRefs = []
     counter = 0
     for feature in polys.GetLayer():
-        outputPath = tempDir + f"clip_{counter}.tif" 
+        outputPath = os.path.join(tempDir, f"clip_{counter}.tif")
         polyAsWKT = feature.geometry().ExportToWkt()
+        window = SubcatchmentWindow(polyAsWKT, transforms, raster.RasterXSize, raster.RasterYSize)
 
-        gdal.Warp(outputPath, raster, **{
-                    #"cropToCutline" : True,
-                    "cutlineWKT" : polyAsWKT,
-                    "cutlineSRS" : crs,
-                    "creationOptions" : {'COMPRESS': 'DEFLATE'}})
+        if isCached is not None and isCached(polyAsWKT):
+            print (f"Found LFP cache of subcatchment {counter}, skipping clipping")
+            clippedRastersRefs.append([None, polyAsWKT, window])
+            counter += 1
+            continue
+        if window[2] == 0 or window[3] == 0:
+            print (f"Subcatchment {counter} is outside the input raster, skipping clipping")
+            clippedRastersRefs.append([None, polyAsWKT, window])
+            counter += 1
+            continue
+        if not clip:
+            clippedRastersRefs.append([None, polyAsWKT, window])
+            counter += 1
+            continue
 
-        clippedRastersRefs.append([outputPath, polyAsWKT])
+        #bounds of the window, so the clip is cropped on the input's grid and its cells map back to the input's by an offset
+        x0 = transforms[0] + window[1] * transforms[1]
+        x1 = transforms[0] + (window[1] + window[3]) * transforms[1]
+        y0 = transforms[3] + window[0] * transforms[5]
+        y1 = transforms[3] + (window[0] + window[2]) * transforms[5]
+        with Instrumentation.Stage("clip", subcatchment = counter, file = outputPath, cells = window[2] * window[3]):
+            gdal.Warp(outputPath, raster, **{
+                        "outputBounds" : [min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)],
+                        "width" : window[3],
+                        "height" : window[2],
+                        "cutlineWKT" : polyAsWKT,
+                        "cutlineSRS" : crs,
+                        "creationOptions" : {'COMPRESS': 'DEFLATE'}})
+
+        clippedRastersRefs.append([outputPath, polyAsWKT, window])
         counter += 1
 
-def LoadOutlets():
+    return clippedRastersRefs
+
+#Returns a list of outlet georeferenced coordinates
+def LoadOutlets(inputOutletsPath : str) -> list:
     geoPoints = ogr.Open(inputOutletsPath, 0)
     featureCount = geoPoints.GetLayer().GetFeatureCount()
     print (f"Loading an outlets file with {featureCount} features")
-    
+
+    outlets = []
     for feature in geoPoints.GetLayer():
         geom = feature.geometry()
         geoCoords = [geom.GetX(), geom.GetY()]
@@ -93,119 +126,174 @@ def LoadOutlets():
         outlets.append(geoCoords)
         print (f"{geoCoords}")
 
-def CreateOutputRaster():
-    global outputRaster
-    inputRaster = gdal.Open(inputRasterPath, gdal.GA_ReadOnly)
-
-    outputPath = baseOutputPath = os.path.dirname(inputRasterPath) + "/lfp.tif" 
-    counter = 1
-    while os.path.exists(outputPath):
-        outputPath = baseOutputPath[:-4] + str(counter) + ".tif"
-        counter += 1
-
-    sourceX = inputRaster.RasterXSize
-    sourceY = inputRaster.RasterYSize
+    return outlets
 
-    outputRaster = gdal.GetDriverByName("GTiff").Create(outputPath, xsize = sourceX, ysize = sourceY, bands = 1, eType = gdal.GDT_Int16)
-
-    outputRaster.SetProjection(inputRaster.GetProjection())
-    outputRaster.SetGeoTransform(inputRaster.GetGeoTransform())
-    outputRaster.GetRasterBand(1).SetNoDataValue(outputNoDataValue)
+#Returns the coordinates of geoCoordPair in the padded image space of the raster at rasterPath, None if it falls outside the raster.
+def GeoCoordToImageSpace(geoCoordPair : list, rasterPath) -> list:
+    raster = gdal.Open(rasterPath, gdal.GA_ReadOnly)
+    transforms = raster.GetGeoTransform()
 
-    #outputArray = numpy.full(shape=(sourceY, sourceX), fill_value = outputNoDataValue, dtype = numpy.int16, order="C")
+    pixel = [  math.floor(-1 * (transforms[3] - geoCoordPair[1]) / transforms[5]) + 1,
+                math.floor((geoCoordPair[0] - transforms[0]) / transforms[1]) + 1]
 
-    print (f"Created output raster at {outputPath}")
+    if not (1 <= pixel[0] <= raster.RasterYSize and 1 <= pixel[1] <= raster.RasterXSize):
+        return None
 
-def GeoCoordToImageSpace(geoCoordPair : list, rasterPath) -> list:
-    transforms = gdal.Open(rasterPath, gdal.GA_ReadOnly).GetGeoTransform()
-    
-    pixel = [  int(-1 * (transforms[3] - geoCoordPair[1]) / transforms[5]) + 1,
-                int((geoCoordPair[0] - transforms[0]) / transforms[1]) + 1]
-    
     return pixel
 
-def AssociateOutletWithRaster(outlet): #returns imagespace coord of outlet and the raster it covers (coords relative to this raster), None if no raster covers the point
+#returns imagespace coord of outlet and the ref of the clipped raster covering it, None if no raster covers the point.
+#Coordinates are in the padded image space of the input raster at inputRasterPath (not the clip's), so that they work for subcatchments
+#that weren't clipped too. Subtract the clip's window offset to get coordinates in the clip.
+def AssociateOutletWithRaster(outlet, clippedRastersRefs : list, inputRasterPath : str):
     for ref in clippedRastersRefs:
-        
+
         ogrPoint = ogr.Geometry(ogr.wkbPoint)
         ogrPoint.AddPoint(outlet[0], outlet[1])
         ogrBoundary = ogr.CreateGeometryFromWkt(ref[1])
-        
+
         if ogrBoundary.Contains(ogrPoint):
-            return GeoCoordToImageSpace(outlet, ref[0]), ref[0]
+            pixel = GeoCoordToImageSpace(outlet, inputRasterPath)
+            return (None, None) if pixel is None else (pixel, ref)
 
     return None, None
 
-def UpstreamNeighbours(pixel : list, fdr) -> list: #return a list of cells that pour to this point
-    #get a view around the pixel
-    rawNeighbours = fdr[pixel[0] - 1 : pixel[0] + 2, pixel[1] - 1 : pixel[1] + 2]
-    #loop and check each neighbour if its pouring towards the centre, using usNeighboursFDR as a reference.
-    usNeighbours = []
-    for row in range(0, 3):
-        for column in range (0, 3):
-            if row == column == 1: #central cell, skip
-                continue
-            if rawNeighbours[row, column] == usNeighboursFDR[row, column]:
-                usNeighbours.append([pixel[0] + row - 1, pixel[1] + column - 1])
-
-    return usNeighbours
-
-#recursive function
-#caveats of this approach (other than obvious overflow risk and performance) is that it gives cardinal and ordinal neighbours same weight.
-def TraceLFP(outlet : list, fdr) -> list:
-    #get surrounding pixels
-    usNeighbours = UpstreamNeighbours(outlet, fdr)
-    
-    if len(usNeighbours) == 0: #this is the heighest point. Ideally at the water divide.
-        return [outlet]
-    
-    longestPath = TraceLFP(usNeighbours[0], fdr)
-
-    for i in range (1, len(usNeighbours)):
-        longestPath2 = TraceLFP(usNeighbours[i], fdr)
-        if (len(longestPath2) > len (longestPath)):
-            longestPath = longestPath2
-    
-    longestPath.append(outlet)
-    return longestPath
-
-def ProcessLFPs():
-    #We create one big array for the output
-    lfpArray = numpy.full(shape=(sourceY, sourceX), fill_value = outputNoDataValue, dtype = numpy.int16, order="C")
+#Trace the LFP of each outlet within the clipped raster covering it. Returns the flat indices (image space of the input raster, mapped
+#back from the clips' windows) and values (outlet's order starting from 1) of all the paths' cells, in tracing order, as numpy arrays.
+#If useFDRCache is True, the input FDR is cached padded as an uncompressed .npy file next to it, once and for all runs, and memory-mapped
+#(see FDR_Cache.py). Each subcatchment's FDR is then its window of that shared cache, masked to the polygon (see MaskedWindowFDR()), so
+#the subcatchments need not be clipped (see ClipToSubcatchments()), and repeated or concurrent runs share the cache's pages.
+#fdrCachePath is where to store that cache, defaults to next to the FDR.
+#lfpCacheKeys, if given, maps each subcatchment's WKT to the key of its upstream grids' cache next to the input raster (see LFP_Cache.py).
+#The paths are then extracted from these grids, which are built and cached from the clipped raster first if needed, instead of traced.
+#The cache stores the clip's window along with the grids, so that cached paths are mapped back with the window they were built with.
+def ProcessLFPs(outlets : list, clippedRastersRefs : list, usNeighboursFDR, inputRasterPath : str, useFDRCache : bool = False,
+                lfpCacheKeys : dict = None, fdrCachePath : str = None):
+    cacheStem = os.path.splitext(inputRasterPath)[0]
+    inputRaster = gdal.Open(inputRasterPath, gdal.GA_ReadOnly)
+    sizeX = inputRaster.RasterXSize
+    sizeY = inputRaster.RasterYSize
+    flatIndices = [numpy.zeros(0, dtype = FlatIndexType(sizeX * sizeY))]
+    values = [numpy.zeros(0, dtype = numpy.int16)]
+    transforms = inputRaster.GetGeoTransform()
+    sharedFDR = None #padded input FDR, memory-mapped on first use if useFDRCache
     outletID = 1 #incremented for each outlet #TODO consider using id of outlet feature attribute (fid?)
     for rawOutlet in outlets:
-        outlet, rasterPath = AssociateOutletWithRaster(rawOutlet)
+        outlet, ref = AssociateOutletWithRaster(rawOutlet, clippedRastersRefs, inputRasterPath)
         if outlet is None:
             print (f"Outlet {rawOutlet} is outside the provided raster or catchments' extents")
             continue
-        
-        print (f"Tracing lfp for {rawOutlet} --> {outlet} using {rasterPath}")
-        raster = gdal.Open(rasterPath, gdal.GA_ReadOnly)
-        #fdr is padded to avoid oob reads in the tracing loop without using condition checks
-        fdr = numpy.pad(raster.ReadAsArray(), 1, "constant", constant_values = outputNoDataValue)
-        lfp = TraceLFP(outlet, fdr)
+        rasterPath = ref[0]
+        lfpCacheKey = None if lfpCacheKeys is None else lfpCacheKeys[ref[1]]
+
+        if lfpCacheKey is not None and IsUpstreamCacheCurrent(cacheStem, lfpCacheKey):
+            print (f"Extracting lfp for {rawOutlet} --> {outlet} from cache")
+            upstreamGrids = LoadUpstreamGrids(cacheStem, lfpCacheKey)
+            window = LoadUpstreamWindow(cacheStem, lfpCacheKey)
+        else:
+            window = ref[2]
+            sourcePath = inputRasterPath if useFDRCache else rasterPath
+            print (f"Tracing lfp for {rawOutlet} --> {outlet} using {sourcePath}")
+            #fdr is padded to avoid oob reads in the tracing loop without using condition checks
+            with Instrumentation.Stage("loadFDR", outlet = outletID, file = sourcePath, useFDRCache = useFDRCache) as record:
+                if useFDRCache:
+                    if sharedFDR is None:
+                        #padded with the FDR's own NoData, same as the Continuous script, so both share the same cache file
+                        sharedFDR = LoadPaddedFDR(inputRasterPath, inputRaster.GetRasterBand(1).GetNoDataValue(), fdrCachePath)
+                    fdr = MaskedWindowFDR(sharedFDR, window, SubcatchmentMask(ref[1], transforms, window), outputNoDataValue)
+                else:
+                    fdr = numpy.pad(gdal.Open(rasterPath, gdal.GA_ReadOnly).ReadAsArray(), 1, "constant", constant_values = outputNoDataValue)
+                record["cells"] = fdr.size
+
+            upstreamGrids = None
+            if lfpCacheKey is not None:
+                with Instrumentation.Stage("buildUpstreamGrids", outlet = outletID, cells = fdr.size):
+                    length, predecessor = BuildUpstreamGrids(fdr, usNeighboursFDR)
+                upstreamGrids = WriteUpstreamGrids(length, predecessor, cacheStem, lfpCacheKey, window)
+
+        clipOutlet = [outlet[0] - window[0], outlet[1] - window[1]] #padded image space of the clip
+        with Instrumentation.Stage("traceLFP", outlet = outletID, pixel = outlet) as record:
+            if upstreamGrids is None:
+                lfp = TraceLFP(clipOutlet, fdr, usNeighboursFDR)
+                paddedWidth = fdr.shape[1]
+            else:
+                paddedWidth = upstreamGrids[0].shape[1]
+                lfp = ExtractLFP(clipOutlet[0] * paddedWidth + clipOutlet[1], *upstreamGrids)
+            record["cells"] = len(lfp)
         print (f"Traced an LFP of length {len(lfp)} pixels")
 
-        for pixel in lfp:
-            pixel = [pixel[0] - 1, pixel[1] - 1] #adjust for the padding
-            lfpArray[pixel[0], pixel[1]] = outletID
+        #adjust for the padding, then map back from the clip's window to the input raster
+        flatIndices.append(WindowToRasterFlatIndices(UnpadFlatIndices(lfp, paddedWidth), window, sizeX, sizeY))
+        values.append(numpy.full(len(lfp), outletID, dtype = numpy.int16))
 
         outletID += 1
-    
-    return lfpArray
 
-def CleanUp():
-    for ref in clippedRastersRefs:
-        os.remove(ref[0])
-    os.removedirs(tempDir)
-
-ProcessInputRaster()
-CreateOutputRaster()
-LoadOutlets()
-result = ProcessLFPs()
-
-outputRaster.GetRasterBand(1).WriteArray(result)
-outputRaster = None
+    return numpy.concatenate(flatIndices), numpy.concatenate(values)
+
+#Remove tempDir and everything in it (clipped rasters, and anything left behind by an interrupted step).
+#Errors are ignored, so that a failed cleanup never hides the exception that interrupted processing.
+def CleanUp(tempDir : str):
+    shutil.rmtree(tempDir, ignore_errors = True)
+
+#Processing steps. Returns the path of the lfp raster written (defaults to lfp.tif next to the FDR).
+#Clipped rasters are stored in tempDir (a new temporary directory if None), which is removed when done, even if processing fails.
+#With useFDRCache, nothing is clipped: subcatchments are masked from the padded FDR cache next to the input instead (see ProcessLFPs()).
+#creationOptions override the output's default GTiff creation options (see Output_Raster.py).
+#If useLFPCache is True, the upstream grids of each subcatchment are cached next to the input raster, keyed by the input's checksum, the
+#encoding and the subcatchment's polygon (see LFP_Cache.py). Reruns with new outlets but the same FDR and subcatchments then skip both
+#clipping and tracing, and only extract the paths.
+def ComputeDiscreteLongestFlowPaths(inputRasterPath : str, inputOutletsPath : str, inputSubcatchmentsPath : str, fdrEncoding : str = "TauDEM",
+                                    outputPath : str = None, tempDir : str = None, useFDRCache : bool = False, creationOptions : dict = None,
+                                    useLFPCache : bool = False, fdrCachePath : str = None) -> str:
+    inputRaster = gdal.Open(inputRasterPath, gdal.GA_ReadOnly)
 
-CleanUp()
-print ("Done!")
+    isCached = None
+    if useLFPCache:
+        cacheStem = os.path.splitext(inputRasterPath)[0]
+        fdrChecksum = FDRChecksum(inputRasterPath)
+        SubcatchmentCacheKey = lambda polyAsWKT: UpstreamCacheKey(fdrChecksum, fdrEncoding, polyAsWKT)
+        isCached = lambda polyAsWKT: IsUpstreamCacheCurrent(cacheStem, SubcatchmentCacheKey(polyAsWKT))
+
+    if tempDir is None:
+        tempDir = tempfile.mkdtemp(prefix = "lfp_clips_")
+    else:
+        os.makedirs(tempDir)
+
+    try:
+        clippedRastersRefs = ClipToSubcatchments(inputRasterPath, inputSubcatchmentsPath, tempDir, isCached, clip = not useFDRCache)
+        lfpCacheKeys = {ref[1] : SubcatchmentCacheKey(ref[1]) for ref in clippedRastersRefs} if useLFPCache else None
+        outlets = LoadOutlets(inputOutletsPath)
+        flatIndices, values = ProcessLFPs(outlets, clippedRastersRefs, usNeighboursFDRConventions[fdrEncoding], inputRasterPath, useFDRCache, lfpCacheKeys,
+                                          fdrCachePath)
+    finally:
+        CleanUp(tempDir)
+
+    outputPath = OutputPath(inputRasterPath) if outputPath is None else outputPath
+    with Instrumentation.Stage("write", file = outputPath, cells = len(flatIndices)):
+        WriteLFPRaster(inputRaster, outputPath, flatIndices, values, outputNoDataValue, creationOptions)
+
+    return outputPath
+
+def Main():
+    parser = argparse.ArgumentParser(description = "Compute the longest flow path of each outlet within its subcatchment from a flow direction raster")
+    parser.add_argument("inputRasterPath", help = "FDR raster")
+    parser.add_argument("inputOutletsPath", help = "outlets OGR file")
+    parser.add_argument("inputSubcatchmentsPath", help = "subcatchments polygons OGR file")
+    parser.add_argument("--encoding", dest = "fdrEncoding", choices = list(usNeighboursFDRConventions.keys()), default = "TauDEM", help = "flow direction convention of the FDR")
+    parser.add_argument("--output", dest = "outputPath", default = None, help = "output path, defaults to lfp.tif next to the FDR")
+    parser.add_argument("--temp-dir", dest = "tempDir", default = None, help = "directory to store clipped rasters in (must not exist), defaults to a new temporary directory")
+    parser.add_argument("--fdr-cache", dest = "useFDRCache", action = "store_true", help = "cache the padded FDR as a memory-mapped .npy file next to it, and mask the subcatchments from it instead of clipping (see FDR_Cache.py)")
+    parser.add_argument("--fdr-cache-path", dest = "fdrCachePath", default = None, help = "where to store the FDR cache, defaults to next to the FDR")
+    parser.add_argument("--lfp-cache", dest = "useLFPCache", action = "store_true",
+                        help = "build (or reuse) each subcatchment's upstream length and predecessor grids next to the FDR, and extract the paths from them (see LFP_Cache.py)")
+    Output_Raster.AddArguments(parser)
+    Instrumentation.AddArguments(parser)
+    args = parser.parse_args()
+
+    with Instrumentation.FromArguments(args, "Discrete_Longest_Flow_Path"):
+        ComputeDiscreteLongestFlowPaths(args.inputRasterPath, args.inputOutletsPath, args.inputSubcatchmentsPath, args.fdrEncoding,
+                                        args.outputPath, args.tempDir, args.useFDRCache, Output_Raster.CreationOptionsFromArguments(args),
+                                        args.useLFPCache, args.fdrCachePath)
+    print ("Done!")
+
+if __name__ == "__main__":
+    Main()
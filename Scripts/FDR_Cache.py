@@ -0,0 +1,60 @@
+#Helpers to cache a flow direction raster (FDR) as an uncompressed, padded .npy file and open it memory-mapped. Used by both
+#Longest_Flow_Path scripts.
+#The tracers need the FDR padded with one NoData cell on each side (to avoid boundary checks). Reading it with ReadAsArray() and then
+#numpy.pad()ing it holds two full copies of the grid in memory, and repeats the whole read on every run. Instead, the padded grid is
+#written once to a .npy file, strip by strip, then opened with numpy.load(mmap_mode = "r"). Startup becomes near instant, only the
+#pages holding cells the tracer touches are actually read, and concurrent runs on the same FDR share these pages through the OS cache.
+#Note: GDAL's own virtual memory mapping (GetVirtualMemAutoArray()) was not used because it can't provide the padding.
+
+from osgeo import gdal, gdal_array
+import numpy, os
+import Instrumentation
+
+#Default location of the cache, next to the FDR itself
+def PaddedCachePath(rasterPath : str) -> str:
+    return os.path.splitext(rasterPath)[0] + "_padded.npy"
+
+#The cache is valid if it is newer than the FDR and matches its size, data type and the requested padding value.
+def IsPaddedCacheCurrent(raster, rasterPath : str, cachePath : str, padValue) -> bool:
+    if not os.path.exists(cachePath) or os.path.getmtime(cachePath) < os.path.getmtime(rasterPath):
+        return False
+
+    cache = numpy.load(cachePath, mmap_mode = "r")
+    dtype = gdal_array.GDALTypeCodeToNumericTypeCode(raster.GetRasterBand(1).DataType)
+    return cache.shape == (raster.RasterYSize + 2, raster.RasterXSize + 2) and cache.dtype == dtype and cache[0, 0] == padValue
+
+def WritePaddedCache(raster, cachePath : str, padValue):
+    band = raster.GetRasterBand(1)
+    sourceX = raster.RasterXSize
+    sourceY = raster.RasterYSize
+    dtype = gdal_array.GDALTypeCodeToNumericTypeCode(band.DataType)
+
+    #write to a temporary file first, then swap it in, so that another process never sees a half written cache
+    tempPath = cachePath + f".{os.getpid()}.tmp"
+    cache = numpy.lib.format.open_memmap(tempPath, mode = "w+", dtype = dtype, shape = (sourceY + 2, sourceX + 2))
+    cache[0, :] = cache[-1, :] = padValue
+    cache[:, 0] = cache[:, -1] = padValue
+
+    #copy the raster in strips of whole blocks, so we never hold more than a strip in memory
+    stripHeight = max(band.GetBlockSize()[1], 256)
+    for rowStart in range(0, sourceY, stripHeight):
+        stripRows = min(stripHeight, sourceY - rowStart)
+        cache[rowStart + 1 : rowStart + 1 + stripRows, 1 : -1] = band.ReadAsArray(0, rowStart, sourceX, stripRows)
+
+    cache.flush()
+    del cache
+    os.replace(tempPath, cachePath)
+
+#Returns a read-only, memory-mapped array of the FDR padded by one cell of padValue on each side (so image space coordinates are
+#shifted by (1, 1), same as numpy.pad(fdr, 1)). The cache is created (or refreshed) first if needed.
+def LoadPaddedFDR(rasterPath : str, padValue, cachePath : str = None):
+    raster = gdal.Open(rasterPath, gdal.GA_ReadOnly)
+    padValue = 0 if padValue is None else padValue #0 isn't a valid direction in any convention, so it's safe as a pad.
+    cachePath = PaddedCachePath(rasterPath) if cachePath is None else cachePath
+
+    if not IsPaddedCacheCurrent(raster, rasterPath, cachePath, padValue):
+        print (f"Caching padded FDR to {cachePath}")
+        with Instrumentation.Stage("writeFDRCache", file = cachePath, cells = raster.RasterXSize * raster.RasterYSize):
+            WritePaddedCache(raster, cachePath, padValue)
+
+    return numpy.load(cachePath, mmap_mode = "r")
@@ -0,0 +1,176 @@
+#Opt-in per stage instrumentation for the scripts in this directory.
+#When enabled, each Stage() records its wall time, CPU time, its own peak RSS and RSS change, the bytes read and written during the stage,
+#and any extra fields the caller adds (e.g. cells processed, outlet or file), and writes them as one JSON object per line.
+#When disabled (the default), Stage() does nothing beyond handing back an empty dict, so it's safe to leave in hot loops.
+#A whole run can also be profiled with cProfile, or pyinstrument if it's installed.
+#Usage from code:
+#   Instrumentation.Enable("stages.jsonl")
+#   with Instrumentation.Stage("trace", outlet = 3) as record:
+#       ...
+#       record["cells"] = len(lfp)
+#Usage from the scripts' command line: --instrument stages.jsonl (or - for stderr) --profile run.prof [--profiler pyinstrument]
+
+import json, os, sys, time
+from contextlib import contextmanager
+
+try:
+    import resource #not available on Windows, peakRSSBytes is then reported as None
+except ImportError:
+    resource = None
+
+_output = None #file the records are written to, None when disabled
+_stagePeaks = [] #highest RSS seen so far by each stage currently open, innermost last (see Stage())
+_processPeak = None #highest RSS seen by any stage, since ResetPeakRSS() also resets the process' own high-water mark
+
+def IsEnabled() -> bool:
+    return _output is not None
+
+#outputPath is the JSON lines file the records are appended to, "-" for stderr.
+def Enable(outputPath : str = "-"):
+    global _output
+    Disable()
+    _output = sys.stderr if outputPath == "-" else open(outputPath, "a")
+
+def Disable():
+    global _output
+    if _output is not None and _output is not sys.stderr:
+        _output.close()
+    _output = None
+
+#High-water mark of the RSS as reported by the OS, since the process started (or since the last ResetPeakRSS() on Linux).
+def PeakRSSBytes():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024 #kilobytes on Linux, bytes on macOS
+
+#Value of field (e.g. "VmRSS", "VmHWM") of /proc/self/status in bytes. Only available on Linux, None elsewhere.
+def StatusBytes(field : str):
+    try:
+        with open("/proc/self/status") as statusFile:
+            for line in statusFile:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) * 1024 #always in kB
+    except (OSError, ValueError):
+        pass
+    return None
+
+#Reset the process' RSS high-water mark (VmHWM) to the current RSS, so that a stage's own peak can be measured. Linux only, returns
+#False if it couldn't be reset.
+def ResetPeakRSS() -> bool:
+    try:
+        with open("/proc/self/clear_refs", "w") as clearRefs:
+            clearRefs.write("5")
+        return True
+    except OSError:
+        return False
+
+def MaxOf(*values):
+    values = [value for value in values if value is not None]
+    return max(values) if len(values) > 0 else None
+
+#Bytes passed through read and write calls so far (including those served from the OS cache, excluding memory-mapped pages).
+#Only available on Linux, [None, None] elsewhere.
+def IOBytes() -> list:
+    try:
+        with open("/proc/self/io") as ioFile:
+            counters = dict(line.split(":") for line in ioFile.read().splitlines())
+        return [int(counters["rchar"]), int(counters["wchar"])]
+    except (OSError, KeyError, ValueError):
+        return [None, None]
+
+def Emit(record : dict):
+    if _output is None:
+        return
+    _output.write(json.dumps(record, default = str) + "\n")
+    _output.flush()
+
+#Time the block as stage "name". fields are added to the record as is, and the block can add more to the yielded dict.
+#peakRSSBytes is the highest RSS reached during the stage (None where the high-water mark can't be reset, i.e. outside Linux),
+#rssDeltaBytes the change in RSS over the stage, and processPeakRSSBytes the process' high-water mark. Stages can be nested: the
+#high-water mark is reset at the start of each stage, and the peaks of inner stages are carried over to the enclosing ones.
+@contextmanager
+def Stage(name : str, **fields):
+    global _processPeak
+    record = dict(fields)
+    if _output is None:
+        yield record
+        return
+
+    readStart, writtenStart = IOBytes()
+    rssStart = StatusBytes("VmRSS")
+    if len(_stagePeaks) > 0: #the reset below would lose the enclosing stage's peak so far
+        _stagePeaks[-1] = MaxOf(_stagePeaks[-1], StatusBytes("VmHWM"))
+    canResetPeak = ResetPeakRSS()
+    _stagePeaks.append(None)
+    wallStart = time.perf_counter()
+    cpuStart = time.process_time()
+    try:
+        yield record
+    finally:
+        wallSeconds = time.perf_counter() - wallStart
+        cpuSeconds = time.process_time() - cpuStart
+        readEnd, writtenEnd = IOBytes()
+        rssEnd = StatusBytes("VmRSS")
+        peakRSS = MaxOf(_stagePeaks.pop(), StatusBytes("VmHWM")) if canResetPeak else None
+        if len(_stagePeaks) > 0:
+            _stagePeaks[-1] = MaxOf(_stagePeaks[-1], peakRSS)
+        _processPeak = MaxOf(_processPeak, peakRSS, PeakRSSBytes())
+
+        Emit({"stage" : name,
+              "wallSeconds" : wallSeconds,
+              "cpuSeconds" : cpuSeconds,
+              "peakRSSBytes" : peakRSS,
+              "rssDeltaBytes" : None if rssStart is None or rssEnd is None else rssEnd - rssStart,
+              "processPeakRSSBytes" : _processPeak,
+              "bytesRead" : None if readStart is None else readEnd - readStart,
+              "bytesWritten" : None if writtenStart is None else writtenEnd - writtenStart,
+              **record})
+
+#Profile the block with profiler ("cProfile" or "pyinstrument"), writing the results to outputPath (a pstats file for cProfile, an
+#html report for pyinstrument). Does nothing if outputPath is None.
+@contextmanager
+def Profile(outputPath : str = None, profiler : str = "cProfile"):
+    if outputPath is None:
+        yield
+        return
+
+    if profiler == "cProfile":
+        import cProfile
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            profile.dump_stats(outputPath)
+    elif profiler == "pyinstrument":
+        from pyinstrument import Profiler #optional dependency, only needed for this profiler
+        profile = Profiler()
+        profile.start()
+        try:
+            yield
+        finally:
+            profile.stop()
+            with open(outputPath, "w") as output:
+                output.write(profile.output_html())
+    else:
+        raise ValueError(f"Unsupported profiler \"{profiler}\". Use cProfile or pyinstrument")
+
+#Command line support, shared by the scripts' Main()
+def AddArguments(parser):
+    parser.add_argument("--instrument", dest = "instrumentPath", default = None, help = "write per stage timing and memory records as JSON lines to this file (- for stderr)")
+    parser.add_argument("--profile", dest = "profilePath", default = None, help = "profile the whole run and write the results to this file")
+    parser.add_argument("--profiler", choices = ["cProfile", "pyinstrument"], default = "cProfile", help = "profiler used with --profile")
+
+#Enable instrumentation and profiling for the block, as requested by the arguments added by AddArguments(). The whole block is also
+#recorded as stage "total".
+@contextmanager
+def FromArguments(args, scriptName : str):
+    if args.instrumentPath is not None:
+        Enable(args.instrumentPath)
+    try:
+        with Profile(args.profilePath, args.profiler), Stage("total", script = scriptName, pid = os.getpid()):
+            yield
+    finally:
+        Disable()
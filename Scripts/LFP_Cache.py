@@ -0,0 +1,101 @@
+#Helpers to persist the per cell longest upstream length and predecessor grids of a flow direction raster (FDR) next to it, so that
+#the Longest_Flow_Path scripts can reuse them across runs with different outlets.
+#Tracing an LFP walks the whole catchment upstream of the outlet, and every run repeats it from scratch. Both grids are instead built
+#once for the whole FDR (see BuildUpstreamGrids() in Continuous_Longest_Flow_Path.py) and saved as uncompressed .npy files, then
+#opened with numpy.load(mmap_mode = "r"). The LFP of any outlet is then found by following the predecessors from it, which only touches
+#the cells on the path.
+#Caches are named after a key made from the FDR's checksum and the flow direction encoding (and, for the Discrete script, the
+#subcatchment's polygon), so an edited FDR or a different encoding never reuses a stale cache. The checksum itself is stored next to
+#the FDR and only recomputed when the FDR's size or modification time change, so checking for a cache doesn't cost a full read.
+#Stale caches are never cleaned up automatically, they can be safely deleted.
+
+from osgeo import gdal, gdal_array
+import numpy, hashlib, json, os
+import Instrumentation
+
+#Returns a checksum (hex string) of the values, size and data type of raster's first band, read in strips.
+def ComputeFDRChecksum(raster) -> str:
+    band = raster.GetRasterBand(1)
+    sourceX = raster.RasterXSize
+    sourceY = raster.RasterYSize
+    dtype = gdal_array.GDALTypeCodeToNumericTypeCode(band.DataType)
+
+    with Instrumentation.Stage("checksumFDR", cells = sourceX * sourceY):
+        checksum = hashlib.sha1(f"{sourceY}x{sourceX}:{numpy.dtype(dtype).str}".encode())
+        stripHeight = max(band.GetBlockSize()[1], 256)
+        for rowStart in range(0, sourceY, stripHeight):
+            checksum.update(numpy.ascontiguousarray(band.ReadAsArray(0, rowStart, sourceX, min(stripHeight, sourceY - rowStart))))
+
+    return checksum.hexdigest()
+
+def ChecksumSidecarPath(rasterPath : str) -> str:
+    return rasterPath + ".sha1.json"
+
+#Returns the checksum of the FDR at rasterPath (see ComputeFDRChecksum()). It's stored in a sidecar file next to the FDR along with the
+#FDR's path, size and modification time, and only recomputed when these change.
+def FDRChecksum(rasterPath : str) -> str:
+    sidecarPath = ChecksumSidecarPath(rasterPath)
+    stats = os.stat(rasterPath)
+    fileInfo = {"path" : os.path.abspath(rasterPath), "size" : stats.st_size, "mtime" : stats.st_mtime_ns}
+
+    try:
+        with open(sidecarPath) as sidecarFile:
+            sidecar = json.load(sidecarFile)
+        if all(sidecar.get(field) == value for field, value in fileInfo.items()):
+            return sidecar["checksum"]
+    except (OSError, ValueError, KeyError):
+        pass #missing or unreadable, recompute
+
+    checksum = ComputeFDRChecksum(gdal.Open(rasterPath, gdal.GA_ReadOnly))
+    tempPath = sidecarPath + f".{os.getpid()}.tmp"
+    with open(tempPath, "w") as sidecarFile:
+        json.dump({**fileInfo, "checksum" : checksum}, sidecarFile)
+    os.replace(tempPath, sidecarPath)
+
+    return checksum
+
+#Key of the cache of an FDR (by its checksum, see FDRChecksum()) traced with fdrEncoding. extra is anything else the grids depend on,
+#e.g. the WKT of the subcatchment the FDR is clipped to.
+def UpstreamCacheKey(fdrChecksum : str, fdrEncoding : str, extra : str = "") -> str:
+    return hashlib.sha1(f"{fdrChecksum}:{fdrEncoding}:{extra}".encode()).hexdigest()[:16]
+
+#Returns the paths of the length grid, predecessor grid and window files of a cache, cacheStem is the path without extension, e.g. the FDR's.
+def UpstreamCachePaths(cacheStem : str, key : str) -> list:
+    return [f"{cacheStem}_lfp_{key}_length.npy", f"{cacheStem}_lfp_{key}_predecessor.npy", f"{cacheStem}_lfp_{key}_window.json"]
+
+def IsUpstreamCacheCurrent(cacheStem : str, key : str) -> bool:
+    return all(os.path.exists(cachePath) for cachePath in UpstreamCachePaths(cacheStem, key))
+
+#Returns the cached length and predecessor grids, as read-only memory-mapped arrays.
+def LoadUpstreamGrids(cacheStem : str, key : str):
+    lengthPath, predecessorPath, _ = UpstreamCachePaths(cacheStem, key)
+    print (f"Loading cached upstream grids {lengthPath}")
+    return numpy.load(lengthPath, mmap_mode = "r"), numpy.load(predecessorPath, mmap_mode = "r")
+
+#Returns the window of the FDR the cached grids cover, as [rowOffset, columnOffset, rows, columns] (see WriteUpstreamGrids()).
+def LoadUpstreamWindow(cacheStem : str, key : str) -> list:
+    with open(UpstreamCachePaths(cacheStem, key)[2]) as windowFile:
+        return json.load(windowFile)
+
+#Save the length and predecessor grids, then return them loaded as in LoadUpstreamGrids(). window is the part of the FDR they were
+#built from, as [rowOffset, columnOffset, rows, columns] in the FDR's (unpadded) image space, defaults to the whole grid.
+def WriteUpstreamGrids(length, predecessor, cacheStem : str, key : str, window : list = None):
+    cachePaths = UpstreamCachePaths(cacheStem, key)
+    window = [0, 0, length.shape[0] - 2, length.shape[1] - 2] if window is None else window
+    print (f"Caching upstream grids to {cachePaths[0]}")
+
+    with Instrumentation.Stage("writeUpstreamGrids", file = cachePaths[0], cells = length.size):
+        #write to temporary files first, then swap them in, so that another process never sees a half written cache. The window is
+        #swapped in last, since IsUpstreamCacheCurrent() requires all three.
+        for grid, cachePath in zip([length, predecessor], cachePaths[0 : 2]):
+            tempPath = cachePath + f".{os.getpid()}.tmp"
+            with open(tempPath, "wb") as cacheFile:
+                numpy.save(cacheFile, grid)
+            os.replace(tempPath, cachePath)
+
+        tempPath = cachePaths[2] + f".{os.getpid()}.tmp"
+        with open(tempPath, "w") as windowFile:
+            json.dump([int(value) for value in window], windowFile)
+        os.replace(tempPath, cachePaths[2])
+
+    return LoadUpstreamGrids(cacheStem, key)
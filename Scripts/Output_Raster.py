@@ -0,0 +1,91 @@
+#Helpers to create the scripts' output GeoTIFFs with tiling, compression and BigTIFF support, and to write them block by block.
+#GTiff's defaults (striped, uncompressed, classic TIFF) make large outputs slow to write, huge on disk, and fail above 4 GB.
+#DefaultCreationOptions() picks tiled, DEFLATE compressed outputs, with the predictor matching the data type, multithreaded
+#compression, and BigTIFF when the output may need it. Any option can be overridden per call or from the command line.
+
+from osgeo import gdal, gdal_array
+import numpy, math
+
+def IsFloatingType(eType) -> bool:
+    return numpy.issubdtype(gdal_array.GDALTypeCodeToNumericTypeCode(eType), numpy.floating)
+
+#Returns the default creation options for a GTiff of data type eType (a gdal.GDT_* constant) as a dict.
+def DefaultCreationOptions(eType) -> dict:
+    return {"TILED" : "YES",
+            "BLOCKXSIZE" : "256",
+            "BLOCKYSIZE" : "256",
+            "COMPRESS" : "DEFLATE",
+            "PREDICTOR" : "3" if IsFloatingType(eType) else "2", #floating point predictor for floats, horizontal differencing for integers
+            "NUM_THREADS" : "ALL_CPUS",
+            "BIGTIFF" : "IF_SAFER"}
+
+#Merge creationOptions (a dict, None values remove the option) over the defaults for eType, as the list of "KEY=VALUE" GDAL expects.
+def CreationOptionsList(eType, creationOptions : dict = None) -> list:
+    options = DefaultCreationOptions(eType)
+    if creationOptions is not None:
+        options.update(creationOptions)
+
+    return [f"{key}={value}" for key, value in options.items() if value is not None]
+
+#Create a single band GTiff at outputPath matching inputRaster's size, projection and transformations.
+def CreateOutputRaster(outputPath : str, inputRaster, eType, noDataValue, creationOptions : dict = None):
+    outputRaster = gdal.GetDriverByName("GTiff").Create(outputPath, xsize = inputRaster.RasterXSize, ysize = inputRaster.RasterYSize, bands = 1,
+                                                         eType = eType, options = CreationOptionsList(eType, creationOptions))
+
+    outputRaster.SetProjection(inputRaster.GetProjection())
+    outputRaster.SetGeoTransform(inputRaster.GetGeoTransform())
+    if noDataValue is not None:
+        outputRaster.GetRasterBand(1).SetNoDataValue(noDataValue)
+
+    return outputRaster
+
+#Number of rows to process at a time when writing band strip by strip: whole rows of blocks, at least minRows rows.
+def StripHeight(band, minRows : int = 256) -> int:
+    blockY = band.GetBlockSize()[1]
+    return blockY * math.ceil(minRows / blockY)
+
+#Write values at the cells of band given by flatIndices (row * band.XSize + column), leaving every other cell as noDataValue, without a
+#full size array in memory. Cells are grouped by the band's blocks, and each touched block is written once. Untouched blocks are filled
+#with NoData by the GTiff driver when the raster is closed. If a cell appears more than once, its last value is kept.
+#Meant for a freshly created band: previously written values in the touched blocks are overwritten with NoData.
+def BurnPixels(band, flatIndices, values, noDataValue):
+    if len(flatIndices) == 0:
+        return
+
+    sizeX = band.XSize
+    sizeY = band.YSize
+    blockX, blockY = band.GetBlockSize()
+
+    #keep the last value of each cell, same as writing them one after the other would
+    flatIndices = numpy.asarray(flatIndices)
+    _, lastFromEnd = numpy.unique(flatIndices[::-1], return_index = True)
+    keep = len(flatIndices) - 1 - lastFromEnd
+    rows, columns = numpy.divmod(flatIndices[keep], sizeX)
+    values = numpy.asarray(values)[keep]
+
+    #sort the cells by block, then write each block's cells in one go
+    blockIDs = (rows // blockY) * math.ceil(sizeX / blockX) + columns // blockX
+    order = numpy.argsort(blockIDs, kind = "stable")
+    rows, columns, values, blockIDs = rows[order], columns[order], values[order], blockIDs[order]
+
+    boundaries = numpy.flatnonzero(numpy.diff(blockIDs)) + 1
+    for start, end in zip(numpy.concatenate([[0], boundaries]), numpy.concatenate([boundaries, [len(blockIDs)]])):
+        xOff = int(columns[start] // blockX) * blockX
+        yOff = int(rows[start] // blockY) * blockY
+        block = numpy.full((min(blockY, sizeY - yOff), min(blockX, sizeX - xOff)), noDataValue, dtype = values.dtype)
+        block[rows[start : end] - yOff, columns[start : end] - xOff] = values[start : end]
+        band.WriteArray(block, xOff, yOff)
+
+#Command line support, shared by the scripts' Main()
+def AddArguments(parser):
+    parser.add_argument("--creation-option", dest = "creationOptions", action = "append", default = [], metavar = "KEY=VALUE",
+                        help = "GTiff creation option overriding the defaults (tiled, DEFLATE, BIGTIFF=IF_SAFER). KEY= removes a default. Can be repeated")
+
+#Returns the --creation-option arguments as a dict for CreateOutputRaster()
+def CreationOptionsFromArguments(args) -> dict:
+    creationOptions = {}
+    for option in args.creationOptions:
+        key, _, value = option.partition("=")
+        creationOptions[key.upper()] = value if value != "" else None
+
+    return creationOptions
@@ -0,0 +1,166 @@
+#Helpers to build a "time stack" over a raster archive: one dataset with one band per date, so that a point's full time series
+#can be sampled with a single read instead of opening every file in the archive. Used by both Batch_Raster_Sampler scripts.
+#Two layouts are supported:
+#   "VRT"   : a GDAL VRT referencing the archive's files. Cheap to build (only an XML file is written), but reading a pixel still
+#             touches the source files behind the VRT (GDAL keeps a pool of them open, so it's still far cheaper than reopening).
+#   "GTiff" : a materialised cube, tiled and pixel interleaved, so all dates of a pixel sit contiguously inside a single tile.
+#             Building it reads every pixel of the archive once, but opens and reads every file once per chunk of the cube rather
+#             than once overall (see BuildTimeStackCube()). After that a point's series is one contiguous read.
+#The date of each band is stored as the band's description in both layouts.
+#Note: a Zarr or NetCDF cube with time-contiguous chunks would give the same layout as the GTiff one, but requires GDAL to be built
+#with those drivers. The pixel interleaved GTiff only needs the driver these scripts already use.
+
+from osgeo import gdal, gdal_array
+from os import path
+import numpy, math
+from xml.sax.saxutils import escape
+import Instrumentation
+
+#Extension used for each supported layout
+timeStackExtensions = {"VRT" : ".vrt", "GTiff" : ".tif"}
+
+#sources is a list of [date, rasterPath, bandIndex], sorted by date. All rasters must share size, transformation and data type.
+def BuildTimeStackVRT(sources : list, vrtPath : str) -> str:
+    first = gdal.Open(sources[0][1], gdal.GA_ReadOnly)
+    sizeX = first.RasterXSize
+    sizeY = first.RasterYSize
+    firstBand = first.GetRasterBand(1)
+    dataType = gdal.GetDataTypeName(firstBand.DataType)
+    noDataValue = firstBand.GetNoDataValue()
+    blockX, blockY = firstBand.GetBlockSize()
+
+    #The VRT is written by hand rather than through gdal.BuildVRT() because we need one band per (file, band) pair, and the
+    #SourceProperties element lets GDAL skip opening the sources until they are actually read.
+    lines = [f"<VRTDataset rasterXSize=\"{sizeX}\" rasterYSize=\"{sizeY}\">",
+             f"  <SRS>{escape(first.GetProjection())}</SRS>",
+             f"  <GeoTransform>{', '.join(repr(value) for value in first.GetGeoTransform())}</GeoTransform>"]
+
+    for bandIndex, (date, rasterPath, sourceBand) in enumerate(sources, start = 1):
+        lines.append(f"  <VRTRasterBand dataType=\"{dataType}\" band=\"{bandIndex}\">")
+        lines.append(f"    <Description>{escape(date)}</Description>")
+        if noDataValue is not None:
+            lines.append(f"    <NoDataValue>{repr(noDataValue)}</NoDataValue>")
+        lines.append("    <SimpleSource>")
+        lines.append(f"      <SourceFilename relativeToVRT=\"0\">{escape(path.abspath(rasterPath))}</SourceFilename>")
+        lines.append(f"      <SourceBand>{sourceBand}</SourceBand>")
+        lines.append(f"      <SourceProperties RasterXSize=\"{sizeX}\" RasterYSize=\"{sizeY}\" DataType=\"{dataType}\" BlockXSize=\"{blockX}\" BlockYSize=\"{blockY}\" />")
+        lines.append(f"      <SrcRect xOff=\"0\" yOff=\"0\" xSize=\"{sizeX}\" ySize=\"{sizeY}\" />")
+        lines.append(f"      <DstRect xOff=\"0\" yOff=\"0\" xSize=\"{sizeX}\" ySize=\"{sizeY}\" />")
+        lines.append("    </SimpleSource>")
+        lines.append("  </VRTRasterBand>")
+    lines.append("</VRTDataset>")
+
+    with open(vrtPath, "w") as output:
+        output.write("\n".join(lines) + "\n")
+
+    return vrtPath
+
+#Materialise the stack into a tiled, pixel interleaved GeoTIFF. blockSize is the tile width/height in pixels, each tile holds
+#blockSize * blockSize * dates values, so keep it small for long archives.
+#The cube is filled chunk by chunk, each chunk being whole tiles of all dates: every source is opened and read once per chunk (only
+#that chunk of it, so every pixel is read once, but a file is opened as many times as there are chunks), and every tile of the cube
+#is written once, complete. Chunks are whole rows of tiles, as many as fit in maxChunkBytes. If a single row of tiles doesn't fit,
+#chunks are instead as many tiles of one row as fit, and sources are read in narrower windows (sources stored in strips then decode
+#each strip once per chunk across). maxChunkBytes is only exceeded when a single tile (blockSize * blockSize * dates values) is
+#larger than it.
+#Note: gdal.Translate() from the VRT was not used: with GDAL's default pool of 100 open datasets and default swath size, it may
+#reopen and reread every source for each swath of rows on long archives.
+def BuildTimeStackCube(sources : list, cubePath : str, blockSize : int = 16, maxChunkBytes : int = 1024 ** 3) -> str:
+    first = gdal.Open(sources[0][1], gdal.GA_ReadOnly)
+    sizeX = first.RasterXSize
+    sizeY = first.RasterYSize
+    dataType = first.GetRasterBand(sources[0][2]).DataType
+    noDataValue = first.GetRasterBand(sources[0][2]).GetNoDataValue()
+    dtype = gdal_array.GDALTypeCodeToNumericTypeCode(dataType)
+
+    cube = gdal.GetDriverByName("GTiff").Create(cubePath, xsize = sizeX, ysize = sizeY, bands = len(sources), eType = dataType,
+                                                options = ["TILED=YES",
+                                                           f"BLOCKXSIZE={blockSize}",
+                                                           f"BLOCKYSIZE={blockSize}",
+                                                           "INTERLEAVE=PIXEL",
+                                                           "COMPRESS=DEFLATE",
+                                                           "BIGTIFF=IF_SAFER"])
+    cube.SetProjection(first.GetProjection())
+    cube.SetGeoTransform(first.GetGeoTransform())
+    for bandIndex in range(1, cube.RasterCount + 1):
+        cube.GetRasterBand(bandIndex).SetDescription(sources[bandIndex - 1][0])
+        if noDataValue is not None:
+            cube.GetRasterBand(bandIndex).SetNoDataValue(noDataValue)
+
+    tileBytes = blockSize * blockSize * len(sources) * numpy.dtype(dtype).itemsize
+    tilesPerChunk = max(1, maxChunkBytes // tileBytes)
+    tilesAcross = math.ceil(sizeX / blockSize)
+    if tilesPerChunk >= tilesAcross: #whole rows of tiles
+        chunkWidth = sizeX
+        chunkHeight = (tilesPerChunk // tilesAcross) * blockSize
+    else:
+        chunkWidth = tilesPerChunk * blockSize
+        chunkHeight = blockSize
+        print (f"Warning! A row of {blockSize} pixels high tiles of all {len(sources)} dates is larger than {maxChunkBytes} bytes, "
+               f"building the cube in chunks {chunkWidth} pixels wide")
+
+    for rowStart in range(0, sizeY, chunkHeight):
+        chunkRows = min(chunkHeight, sizeY - rowStart)
+        for columnStart in range(0, sizeX, chunkWidth):
+            chunkColumns = min(chunkWidth, sizeX - columnStart)
+            with Instrumentation.Stage("buildTimeStackChunk", file = cubePath, row = rowStart, column = columnStart, cells = chunkRows * chunkColumns * len(sources)):
+                chunk = numpy.empty((len(sources), chunkRows, chunkColumns), dtype = dtype)
+                for dateIndex, (date, rasterPath, sourceBand) in enumerate(sources):
+                    chunk[dateIndex] = gdal.Open(rasterPath, gdal.GA_ReadOnly).GetRasterBand(sourceBand).ReadAsArray(columnStart, rowStart, chunkColumns, chunkRows)
+                cube.WriteArray(chunk, columnStart, rowStart)
+
+    cube = None #flush to disk
+    return cubePath
+
+def BuildTimeStack(sources : list, stackPath : str, stackFormat : str) -> str:
+    print (f"Building {stackFormat} time stack of {len(sources)} dates at {stackPath}")
+    with Instrumentation.Stage("buildTimeStack", file = stackPath, format = stackFormat, dates = len(sources)):
+        if stackFormat == "VRT":
+            return BuildTimeStackVRT(sources, stackPath)
+        elif stackFormat == "GTiff":
+            return BuildTimeStackCube(sources, stackPath)
+
+    raise ValueError(f"Unsupported time stack format \"{stackFormat}\". Use one of {list(timeStackExtensions.keys())}")
+
+def ListTimeStackDates(stack) -> list:
+    return [stack.GetRasterBand(bandIndex).GetDescription() for bandIndex in range(1, stack.RasterCount + 1)]
+
+#A stack is reused if it holds exactly the dates in sources and is newer than every raster in the archive.
+def IsTimeStackCurrent(sources : list, stackPath : str) -> bool:
+    if not path.exists(stackPath):
+        return False
+
+    stackTime = path.getmtime(stackPath)
+    if any(path.getmtime(rasterPath) > stackTime for rasterPath in set(source[1] for source in sources)):
+        return False
+
+    stack = gdal.Open(stackPath, gdal.GA_ReadOnly)
+    return stack is not None and ListTimeStackDates(stack) == [source[0] for source in sources]
+
+#Build the stack if needed (or if rebuild is True), and return it opened.
+def OpenTimeStack(sources : list, stackPath : str, stackFormat : str, rebuild : bool = False):
+    if rebuild or not IsTimeStackCurrent(sources, stackPath):
+        BuildTimeStack(sources, stackPath, stackFormat)
+    else:
+        print (f"Reusing time stack at {stackPath}")
+
+    return gdal.Open(stackPath, gdal.GA_ReadOnly)
+
+#Practically a nearest neighbour sampler, same as the per-file samplers, but reads all dates of a point in one call.
+#points is a dict with key = point ID and value = coordinates in the stack's CRS. Returns a dict of dicts, date then pointID.
+def SampleTimeStack(stack, points : dict) -> dict:
+    transformations = stack.GetGeoTransform() #anchor coord x and y = 0 and 3, pixelSizeX = 1, pixelSizeY = 5
+    dates = ListTimeStackDates(stack)
+
+    timeSeries = {date : {} for date in dates}
+    for pointID in points.keys():
+        geoRefCoords = points[pointID]
+        x = int((geoRefCoords[0] - transformations[0]) / transformations[1])
+        y = int(-1 * (transformations[3] - geoRefCoords[1]) / transformations[5])
+
+        #a 1x1 window over all bands, returned as (bands, 1, 1) (or (1, 1) for single band stacks)
+        values = stack.ReadAsArray(x, y, 1, 1).reshape(-1)
+        for date, value in zip(dates, values):
+            timeSeries[date][pointID] = value
+
+    return timeSeries